@@ -2,4 +2,8 @@ from django.apps import AppConfig
 
 
 class NoticeConfig(AppConfig):
-    name = 'notice'
+    name = "apps.notice"
+    label = "notice"
+
+    def ready(self):
+        from . import signals  # noqa: F401
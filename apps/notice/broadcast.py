@@ -0,0 +1,191 @@
+# author:hao.lu
+# create_date: 10/17/2020 10:15 AM
+# file : broadcast.py
+# IDE: PyCharm
+
+# ! -*- coding: utf-8 -*-
+import logging
+import os
+import queue
+import threading
+import uuid
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.notice.models import Notice
+from apps.notice.unread_counter import unread_counter
+from apps.system.models import Dept, Users
+from utils.querySetUtil import get_child_queryset2
+
+logger = logging.getLogger("log")
+
+DEFAULT_NOTICE_BROADCAST = {
+    # 每次bulk_create插入的通知数
+    "BATCH_SIZE": 1000,
+    # True时在请求线程中同步发送, 用于测试
+    "SYNC": False,
+}
+BROADCAST_JOB_KEY = "notice:broadcast:{}"
+BROADCAST_JOB_TIMEOUT = 24 * 60 * 60
+
+
+def get_config():
+    return dict(DEFAULT_NOTICE_BROADCAST, **getattr(settings, "NOTICE_BROADCAST", {}))
+
+
+def resolve_recipients(user_ids=None, dept_id=None, role_id=None):
+    """
+    按用户ID、部门(含子部门)、角色解析接收用户, 多个条件取并集
+    Args:
+        user_ids: 用户ID集合
+        dept_id: 部门ID
+        role_id: 角色ID
+
+    Returns: 接收用户ID的QuerySet
+
+    """
+    condition = Q()
+    if user_ids:
+        condition |= Q(id__in=user_ids)
+    if dept_id:
+        dept = Dept.objects.filter(pk=dept_id, is_deleted=False).first()
+        if dept is not None:
+            condition |= Q(dept__in=get_child_queryset2(dept))
+    if role_id:
+        condition |= Q(roles=role_id)
+    if not condition:
+        return Users.objects.none().values_list("id", flat=True)
+    return (
+        Users.objects.filter(condition, is_deleted=False, is_activate=True)
+        .values_list("id", flat=True)
+        .distinct()
+        .order_by("id")
+    )
+
+
+class BroadcastQueue:
+    """
+    进程内的通知广播队列, 后台线程按批bulk_create通知, 进度写入缓存
+    进程重启时未执行完的任务会丢失, 进度中的状态停留在pending/running
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, actor, verb, description, level=None, user_ids=None, dept_id=None, role_id=None):
+        """
+        提交广播任务, 立即返回任务ID
+        Args:
+            actor: 发送者
+            verb: 通知标题
+            description: 通知内容
+            level: 通知级别, 默认info
+            user_ids: 接收用户ID集合
+            dept_id: 接收部门ID, 包含子部门
+            role_id: 接收角色ID
+
+        Returns: 任务ID
+
+        """
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "actor_content_type_id": ContentType.objects.get_for_model(actor).pk,
+            "actor_object_id": actor.pk,
+            "verb": str(verb),
+            "description": description,
+            "level": level or Notice.LEVELS.info,
+            "timestamp": timezone.now(),
+            "recipients": {"user_ids": user_ids, "dept_id": dept_id, "role_id": role_id},
+        }
+        self._set_progress(job["job_id"], status="pending", total=None, sent=0)
+        if get_config()["SYNC"]:
+            self.run(job)
+        else:
+            transaction.on_commit(lambda: self._put(job))
+        return job["job_id"]
+
+    def _put(self, job):
+        # fork出的worker进程不继承线程, 按进程启动后台线程
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    thread = threading.Thread(
+                        target=self._work, name="notice-broadcast", daemon=True
+                    )
+                    thread.start()
+                    self._pid = os.getpid()
+        self._queue.put(job)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self.run(job)
+            finally:
+                close_old_connections()
+
+    def run(self, job):
+        """
+        执行广播任务
+        """
+        job_id = job["job_id"]
+        try:
+            recipient_ids = list(resolve_recipients(**job["recipients"]))
+            total = len(recipient_ids)
+            self._set_progress(job_id, status="running", total=total, sent=0)
+            batch_size = get_config()["BATCH_SIZE"]
+            for start in range(0, total, batch_size):
+                batch = recipient_ids[start:start + batch_size]
+                Notice.objects.bulk_create(
+                    [
+                        Notice(
+                            recipient_id=recipient_id,
+                            actor_content_type_id=job["actor_content_type_id"],
+                            actor_object_id=job["actor_object_id"],
+                            verb=job["verb"],
+                            description=job["description"],
+                            level=job["level"],
+                            timestamp=job["timestamp"],
+                        )
+                        for recipient_id in batch
+                    ]
+                )
+                # bulk_create不触发post_save, 单独累加未读计数
+                unread_counter.incr_many(batch)
+                self._set_progress(
+                    job_id, status="running", total=total, sent=start + len(batch)
+                )
+            self._set_progress(job_id, status="done", total=total, sent=total)
+        except Exception as e:
+            logger.exception("notice broadcast %s failed", job_id)
+            progress = self.progress(job_id) or {}
+            self._set_progress(
+                job_id,
+                status="failed",
+                total=progress.get("total"),
+                sent=progress.get("sent", 0),
+                error=str(e),
+            )
+
+    @staticmethod
+    def _set_progress(job_id, **progress):
+        progress["job_id"] = job_id
+        cache.set(BROADCAST_JOB_KEY.format(job_id), progress, BROADCAST_JOB_TIMEOUT)
+
+    @staticmethod
+    def progress(job_id):
+        """
+        Returns: {"job_id", "status", "total", "sent"}, 任务不存在时返回None
+        """
+        return cache.get(BROADCAST_JOB_KEY.format(job_id))
+
+
+broadcast_queue = BroadcastQueue()
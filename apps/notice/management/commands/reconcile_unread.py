@@ -0,0 +1,45 @@
+# author:hao.lu
+# create_date: 10/17/2020 5:10 PM
+# file : reconcile_unread.py
+# IDE: PyCharm
+
+# ! -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from apps.notice.unread_counter import unread_counter
+from apps.system.models import Users
+
+
+class Command(BaseCommand):
+    """
+    以数据库为准校正用户未读通知计数, 建议由crontab定期执行
+    example: python manage.py reconcile_unread --batch-size 1000
+    """
+
+    help = "Reconcile per-user unread notice counters with the notice table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--user-id", type=int, action="append", dest="user_ids")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        user_ids = options["user_ids"]
+        if user_ids is None:
+            user_ids = (
+                Users.objects.order_by("id")
+                .values_list("id", flat=True)
+                .iterator(chunk_size=batch_size)
+            )
+        batch = []
+        total = 0
+        for user_id in user_ids:
+            batch.append(user_id)
+            if len(batch) >= batch_size:
+                unread_counter.reconcile(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            unread_counter.reconcile(batch)
+            total += len(batch)
+        self.stdout.write("reconciled {} users".format(total))
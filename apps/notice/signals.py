@@ -0,0 +1,42 @@
+# author:hao.lu
+# create_date: 10/17/2020 4:30 PM
+# file : signals.py
+# IDE: PyCharm
+
+# ! -*- coding: utf-8 -*-
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .models import Notice
+from .unread_counter import unread_counter
+
+
+def _is_unread(instance):
+    # 只统计已加载字段, 避免访问延迟加载字段产生查询
+    fields = instance.__dict__
+    if "unread" not in fields or "deleted" not in fields:
+        return None
+    return bool(fields["unread"] and not fields["deleted"])
+
+
+@receiver(post_init, sender=Notice)
+def notice_loaded(sender, instance, **kwargs):
+    instance._counted_unread = _is_unread(instance) if instance.pk else False
+
+
+@receiver(post_save, sender=Notice)
+def notice_saved(sender, instance, created, **kwargs):
+    was_unread = False if created else instance._counted_unread
+    is_unread = _is_unread(instance)
+    if was_unread is None or is_unread is None:
+        # 状态未知, 删除计数器, 下次读取时从数据库初始化
+        unread_counter.drop(instance.recipient_id)
+    elif was_unread != is_unread:
+        unread_counter.incr(instance.recipient_id, 1 if is_unread else -1)
+    instance._counted_unread = is_unread
+
+
+@receiver(post_delete, sender=Notice)
+def notice_deleted(sender, instance, **kwargs):
+    if _is_unread(instance):
+        unread_counter.incr(instance.recipient_id, -1)
@@ -1 +1,115 @@
-# Create your tests here.
+import json
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from notifications.signals import notify
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.notice.models import Notice
+from apps.notice.unread_counter import unread_counter
+from apps.system.models import Dept, Role, Users
+from apps.system.perm_cache import open_session
+from utils.local_cache import local_cache
+
+
+@override_settings(NOTICE_BROADCAST={"BATCH_SIZE": 2, "SYNC": True})
+class NoticeBroadcastTest(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        local_cache.clear()
+        Dept.objects.create(dept_id=1, dept_name="总公司", dept_sort=1)
+        Dept.objects.create(dept_id=2, dept_name="华南分部", pid=1, dept_sort=2)
+        Dept.objects.create(dept_id=3, dept_name="开发部", pid=2, dept_sort=3)
+        Dept.objects.create(dept_id=4, dept_name="华北分部", pid=1, dept_sort=4)
+        role = Role.objects.create(role_id=1, role_name="管理员", role_level=1)
+        self.admin = Users.objects.create(id=1, user_name="admin", is_admin=True)
+        for user_id, dept_id in [(2, 2), (3, 3), (4, 3), (5, 4), (6, 4)]:
+            Users.objects.create(id=user_id, user_name="user%s" % user_id, dept_id=dept_id)
+        Users.objects.filter(id=4).update(is_activate=False)
+        Users.objects.get(id=6).roles.add(role)
+        self.api_client = APIClient()
+        self.login(self.admin)
+
+    def login(self, user):
+        """
+        签发token并写入会话, 之后的请求以该用户认证
+        """
+        token = AccessToken.for_user(user)
+        open_session(user, token["jti"], 60)
+        self.api_client.credentials(HTTP_AUTHORIZATION="Bearer {0}".format(token))
+
+    def broadcast(self, data):
+        response = self.api_client.post("/notice/noticeBroadcast/", data=data, format="json")
+        return json.loads(response.content)["data"]
+
+    def test_broadcast(self):
+        progress = self.broadcast(
+            {"dept_id": 2, "role_id": 1, "title": "系统维护通知", "content": "今晚22点维护"}
+        )
+        self.assertEqual(progress["status"], "done")
+        self.assertEqual((progress["total"], progress["sent"]), (3, 3))
+        recipients = Notice.objects.values_list("recipient_id", flat=True)
+        self.assertEqual(sorted(recipients), [2, 3, 6])
+        response = self.api_client.get(
+            "/notice/noticeBroadcast/{}/".format(progress["job_id"])
+        )
+        self.assertEqual(json.loads(response.content)["data"], progress)
+
+    def test_broadcast_validation(self):
+        response = self.api_client.post(
+            "/notice/noticeBroadcast/", data={"title": "系统维护通知"}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(json.loads(response.content)["msg"][0]), 2)
+        response = self.api_client.post(
+            "/notice/noticeBroadcast/",
+            data={"recipient_ids": "1,2", "title": "通知", "content": "内容"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        # 部门、角色ID在入队前校验
+        for data in ({"dept_id": "abc"}, {"role_id": [1]}, {"dept_id": True}):
+            data.update(title="通知", content="内容")
+            response = self.api_client.post("/notice/noticeBroadcast/", data=data, format="json")
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Notice.objects.exists())
+        # 表单提交的数字字符串可以解析
+        response = self.api_client.post(
+            "/notice/noticeBroadcast/", data={"dept_id": "3", "title": "通知", "content": "内容"}
+        )
+        self.assertEqual(json.loads(response.content)["data"]["status"], "done")
+        response = self.api_client.get("/notice/noticeBroadcast/missing/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_unread_counter(self):
+        user = Users.objects.get(id=2)
+        notify.send(self.admin, recipient=user, verb="通知1", description="内容")
+        notice = Notice.objects.get(recipient=user)
+        self.assertEqual(unread_counter.get(user.id), 1)
+        self.broadcast({"recipient_ids": [2, 3], "title": "通知2", "content": "内容"})
+        notify.send(self.admin, recipient=user, verb="通知3", description="内容")
+        Users.objects.filter(id=2).update(is_admin=True)
+        user.refresh_from_db()
+        self.login(user)
+        # 计数来自缓存, 不查询通知表
+        with self.assertNumQueries(1):
+            response = self.api_client.get("/notice/list/count/")
+        self.assertEqual(json.loads(response.content)["data"]["un_read_count"], 3)
+        self.api_client.put("/notice/markRead/{}/".format(notice.id))
+        self.assertEqual(unread_counter.get(user.id), 2)
+        Notice.objects.filter(recipient=user, unread=True).first().delete()
+        self.assertEqual(unread_counter.get(user.id), 1)
+        # 绕过信号的批量修改由reconcile_unread校正
+        Notice.objects.filter(recipient=user).update(unread=True)
+        call_command("reconcile_unread", stdout=StringIO())
+        self.assertEqual(unread_counter.get(user.id), 2)
+        self.assertEqual(unread_counter.get(3), 1)
+
+    def test_notice_export(self):
+        self.broadcast({"recipient_ids": [1, 2], "title": "通知", "content": "内容"})
+        response = self.api_client.get("/notice/list/export/?file_type=ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([(row["verb"], row["unread"]) for row in rows], [("通知", True)])
@@ -0,0 +1,118 @@
+# author:hao.lu
+# create_date: 10/17/2020 4:05 PM
+# file : unread_counter.py
+# IDE: PyCharm
+
+# ! -*- coding: utf-8 -*-
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from apps.notice.models import Notice
+
+UNREAD_KEY = "notice:unread:{}"
+
+# 仅对已存在的计数器加减, 不存在的计数器在下次读取时从数据库初始化
+INCR_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('INCRBY', key, ARGV[1])
+    end
+end
+return 1
+"""
+
+
+def count_unread(user_ids):
+    """
+    从数据库统计未读通知数
+    Args:
+        user_ids: 用户ID集合
+
+    Returns: {user_id: count}, 没有未读通知的用户为0
+
+    """
+    counts = dict.fromkeys(user_ids, 0)
+    rows = (
+        Notice.objects.filter(recipient__in=list(counts), unread=True, deleted=False)
+        .values_list("recipient")
+        .annotate(count=Count("id"))
+        .order_by()
+    )
+    counts.update(rows)
+    return counts
+
+
+class UnreadCounter:
+    """
+    每个用户的未读通知数, 通知新增、已读、删除时原子加减
+    计数器不存在时从数据库初始化, 批量update等绕过信号的修改由reconcile_unread命令定期校正
+    """
+
+    def __init__(self):
+        self.redis = "django_redis" in settings.CACHES["default"]["BACKEND"]
+        self._script = None
+
+    @staticmethod
+    def key(user_id):
+        return UNREAD_KEY.format(user_id)
+
+    def get(self, user_id):
+        """
+        Returns: 未读通知数
+        """
+        key = self.key(user_id)
+        count = cache.get(key)
+        if count is None:
+            count = count_unread([user_id])[user_id]
+            cache.add(key, count, timeout=None)
+            count = cache.get(key, count)
+        return count
+
+    def incr(self, user_id, delta=1):
+        try:
+            cache.incr(self.key(user_id), delta)
+        except ValueError:
+            # 计数器不存在, 下次读取时初始化
+            pass
+
+    def drop(self, user_id):
+        cache.delete(self.key(user_id))
+
+    def incr_many(self, user_ids, delta=1):
+        """
+        批量加减, redis下为一次脚本调用
+        """
+        if not user_ids:
+            return
+        if not self.redis:
+            for user_id in user_ids:
+                self.incr(user_id, delta)
+            return
+        if self._script is None:
+            from django_redis import get_redis_connection
+
+            self._script = get_redis_connection("default").register_script(INCR_SCRIPT)
+        self._script(
+            keys=[cache.make_key(self.key(user_id)) for user_id in user_ids],
+            args=[delta],
+        )
+
+    def reconcile(self, user_ids):
+        """
+        以数据库为准重置计数器
+        Args:
+            user_ids: 用户ID集合
+
+        Returns: {user_id: count}
+
+        """
+        counts = count_unread(user_ids)
+        cache.set_many(
+            {self.key(user_id): count for user_id, count in counts.items()},
+            timeout=None,
+        )
+        return counts
+
+
+unread_counter = UnreadCounter()
@@ -12,6 +12,7 @@ from apps.notice.views import (
     CommentNoticeUpdateView,
     CommentNoticeListView,
     CommentNoticeSendView,
+    NoticeBroadcastView,
 )
 
 router = routers.DefaultRouter()
@@ -21,4 +22,7 @@ urlpatterns = [
     # 更新通知状态
     path("markRead/<notice_id>/", CommentNoticeUpdateView.as_view()),
     path("noticeSend/", CommentNoticeSendView.as_view()),
+    # 广播通知及查询发送进度
+    path("noticeBroadcast/", NoticeBroadcastView.as_view()),
+    path("noticeBroadcast/<job_id>/", NoticeBroadcastView.as_view()),
 ]
@@ -3,11 +3,14 @@
 from notifications.signals import notify
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 
+from apps.notice.broadcast import broadcast_queue
 from apps.notice.models import Notice
+from apps.notice.unread_counter import unread_counter
 from apps.notice.serializers import NotificationSerializer
 from apps.system.models import Users
 from utils.constant import (
@@ -15,14 +18,19 @@ from utils.constant import (
     JSON_NOTICE_TITLE_IS_NULL_VALIDATION_ERROR,
     JSON_NOTICE_CONTENT_IS_NULL_VALIDATION_ERROR,
     JSON_NOTICE_ID_NULL_VALIDATION_ERROR,
+    JSON_NOTICE_RECIPIENT_IDS_VALIDATION_ERROR,
+    JSON_NOTICE_DEPT_ID_VALIDATION_ERROR,
+    JSON_NOTICE_ROLE_ID_VALIDATION_ERROR,
 )
-from utils.pagination import MyPagination
+from utils.export import stream_export
+from utils.pagination import MyPagination, PaginationModeMixin
 
 
-class CommentNoticeListView(ModelViewSet):
+class CommentNoticeListView(PaginationModeMixin, ModelViewSet):
     """通知列表"""
 
     serializer_class = NotificationSerializer
+    cursor_ordering = "-id"
     _paginator = MyPagination()
 
     def get_queryset(self, *args, **kwargs):
@@ -38,15 +46,25 @@ class CommentNoticeListView(ModelViewSet):
                     "-id"
                 )
 
-    def paginate_queryset(self, queryset):
+    @action(methods=["get"], detail=False, url_path="export")
+    def notice_export(self, request):
         """
-        如果查询参数里没有page但有type或type__code时则不分页,否则请求分页
+        流式导出当前用户的通知, file_type: csv(默认) 或 ndjson
         """
-        if self.paginator is None:
-            return None
-        elif not self.request.query_params.get("page", None):
-            return None
-        return self.paginator.paginate_queryset(queryset, self.request, view=self)
+        fields = [
+            ("id", "id"),
+            ("verb", "verb"),
+            ("description", "description"),
+            ("level", "level"),
+            ("unread", "unread"),
+            ("timestamp", "timestamp"),
+        ]
+        return stream_export(
+            self.get_queryset(),
+            fields,
+            request.query_params.get("file_type", "csv"),
+            "notice",
+        )
 
     @action(
         methods=["get"],
@@ -59,9 +77,7 @@ class CommentNoticeListView(ModelViewSet):
         user = self.request.user
         json_result = {}
         if user:
-            un_read_count = Notice.objects.filter(
-                unread=True, deleted=False, recipient=user
-            ).count()
+            un_read_count = unread_counter.get(user.id)
             json_result["user_id"] = user.id
             json_result["user_name"] = user.user_name
             json_result["un_read_count"] = un_read_count
@@ -112,3 +128,74 @@ class CommentNoticeSendView(APIView):
                 error_list,
                 status=status.HTTP_400_BAD_REQUEST,
             )
+
+
+def _is_id_list(value):
+    # 字符串等可迭代对象会被逐个字符当作ID, 只接受整数列表
+    return isinstance(value, list) and all(
+        isinstance(item, int) and not isinstance(item, bool) for item in value
+    )
+
+
+def _parse_id(value):
+    """
+    解析单个ID, 表单提交时为数字字符串
+    Returns: (ID, 是否合法), 未提供时ID为None
+    """
+    if value is None or value == "":
+        return None, True
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        value = int(value)
+    if isinstance(value, int) and not isinstance(value, bool) and value > 0:
+        return value, True
+    return None, False
+
+
+class NoticeBroadcastView(APIView):
+    """
+    按用户ID、部门(含子部门)或角色广播通知, 后台批量发送
+    """
+
+    perms_map = {"post": "notice_broadcast", "get": "notice_broadcast"}
+
+    def post(self, request, *args, **kwargs):
+        error_list = []
+        request_dict = request.data
+        user_ids = request_dict.get("recipient_ids")
+        dept_id, dept_id_valid = _parse_id(request_dict.get("dept_id"))
+        role_id, role_id_valid = _parse_id(request_dict.get("role_id"))
+        verb = request_dict.get("title")
+        description = request_dict.get("content")
+        # ID在后台线程中才使用, 入队前校验, 避免返回已受理但随后失败的任务
+        if user_ids is not None and not _is_id_list(user_ids):
+            error_list.append(JSON_NOTICE_RECIPIENT_IDS_VALIDATION_ERROR)
+        if not dept_id_valid:
+            error_list.append(JSON_NOTICE_DEPT_ID_VALIDATION_ERROR)
+        if not role_id_valid:
+            error_list.append(JSON_NOTICE_ROLE_ID_VALIDATION_ERROR)
+        if not (user_ids or dept_id or role_id) and dept_id_valid and role_id_valid:
+            error_list.append(JSON_NOTICE_SEND_USER_NOT_EXIST_VALIDATION_ERROR)
+        if not verb:
+            error_list.append(JSON_NOTICE_TITLE_IS_NULL_VALIDATION_ERROR)
+        if not description:
+            error_list.append(JSON_NOTICE_CONTENT_IS_NULL_VALIDATION_ERROR)
+        if error_list:
+            return Response(error_list, status=status.HTTP_400_BAD_REQUEST)
+
+        job_id = broadcast_queue.submit(
+            request.user,
+            verb,
+            description,
+            level=request_dict.get("level"),
+            user_ids=user_ids,
+            dept_id=dept_id,
+            role_id=role_id,
+        )
+        return Response(broadcast_queue.progress(job_id), status=status.HTTP_200_OK)
+
+    def get(self, request, job_id=None, *args, **kwargs):
+        # 查询广播进度
+        progress = broadcast_queue.progress(job_id) if job_id else None
+        if progress is None:
+            raise NotFound()
+        return Response(progress)
@@ -1,5 +1,20 @@
+import logging
+
 from django.apps import AppConfig
 
+logger = logging.getLogger("log")
+
 
 class SystemConfig(AppConfig):
-    name = "system"
+    name = "apps.system"
+    label = "system"
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from utils.crypto_util import private_key_manager, public_key_manager
+
+        for manager in (public_key_manager, private_key_manager):
+            try:
+                manager.preload()
+            except OSError:
+                logger.warning("rsa key file %s not found", manager.path)
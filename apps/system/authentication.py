@@ -4,13 +4,68 @@
 # IDE: PyCharm
 
 # ! -*- coding: utf-8 -*-
+import hashlib
+import logging
+
 from django.contrib.auth.backends import ModelBackend
-from django.db.models import Q
+from django.contrib.auth.hashers import check_password, make_password
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from utils.credential_pool import credential_pool
 from utils.crypto_util import rsa_decode
 
+logger = logging.getLogger("log")
+
 UserModel = get_user_model()
 
+# 可用于登录的字段, 均有索引
+LOGIN_FIELDS = ("user_name", "phone", "email")
+# 不存在的登录标识缓存, 用户保存时清除
+MISSING_KEY = "auth:missing:{}"
+MISSING_TIMEOUT = 5 * 60
+
+
+def missing_key(identifier):
+    return MISSING_KEY.format(hashlib.md5(identifier.encode()).hexdigest())
+
+
+def forget_missing(*users):
+    """
+    用户新增或修改后清除其登录标识的不存在缓存
+    """
+    identifiers = {
+        getattr(user, field) for user in users for field in LOGIN_FIELDS
+    } - {None, ""}
+    if identifiers:
+        cache.delete_many([missing_key(identifier) for identifier in identifiers])
+
+
+def lookup_user(identifier):
+    """
+    按用户名、手机号或邮箱查找用户
+    每个字段单独走索引查询再UNION, 避免OR条件导致全表扫描
+    Args:
+        identifier: 登录标识
+
+    Returns: 用户对象, 不存在或匹配到多个用户时返回None
+
+    """
+    key = missing_key(identifier)
+    if cache.get(key):
+        return None
+    manager = UserModel._default_manager
+    queries = [
+        manager.filter(**{field: identifier}).order_by() for field in LOGIN_FIELDS
+    ]
+    users = list(queries[0].union(*queries[1:])[:2])
+    if not users:
+        cache.set(key, True, MISSING_TIMEOUT)
+        return None
+    if len(users) > 1:
+        logger.warning("login identifier matches multiple users")
+        return None
+    return users[0]
+
 
 class CustomBackend(ModelBackend):
     def authenticate(self, request, user_name=None, password=None, **kwargs):
@@ -18,14 +73,40 @@ class CustomBackend(ModelBackend):
             user_name = kwargs.get(UserModel.USERNAME_FIELD)
         if user_name is None or password is None:
             return
-        try:
-            user = UserModel._default_manager.get(
-                Q(user_name=user_name) | Q(phone=user_name) | Q(email=user_name)
-            )
-        except UserModel.DoesNotExist:
-
+        user = lookup_user(user_name)
+        if user is None:
             return
         else:
-            decode_password = rsa_decode(password)
-            if user.check_password(decode_password) and self.user_can_authenticate(user):
+            valid, upgraded = credential_pool.run(
+                self.verify_password, password, user.password
+            )
+            if upgraded:
+                # hash算法或迭代次数变更, 与AbstractBaseUser.check_password一致更新密码
+                user.password = upgraded
+                user.save(update_fields=["password"])
+            if valid and self.user_can_authenticate(user):
                 return user
+
+    @staticmethod
+    def verify_password(password, encoded):
+        """
+        在credential_pool中执行的解密与校验
+        Args:
+            password: rsa加密后的密码
+            encoded: 数据库中的密码hash
+
+        Returns: (是否通过, 需要升级时的新hash), 无法解密时视为密码错误
+
+        """
+        try:
+            password = rsa_decode(password)
+        except (ValueError, AttributeError):
+            # base64格式错误、密文长度错误, 或解密失败时cipher返回None
+            return False, None
+        upgraded = []
+        valid = check_password(
+            password,
+            encoded,
+            setter=lambda raw_password: upgraded.append(make_password(raw_password)),
+        )
+        return valid, upgraded[0] if upgraded else None
@@ -0,0 +1,284 @@
+# author:hao.lu
+# create_date: 10/16/2020 3:20 PM
+# file : login_limiter.py
+# IDE: PyCharm
+
+# ! -*- coding: utf-8 -*-
+import hashlib
+import ipaddress
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.exceptions import Throttled
+
+logger = logging.getLogger("log")
+
+DEFAULT_LOGIN_LIMIT = {
+    # 滑动窗口长度(秒)
+    "WINDOW": 5 * 60,
+    # 窗口内同一登录标识允许的失败次数
+    "IDENTIFIER_LIMIT": 5,
+    # 窗口内同一IP允许的失败次数
+    "IP_LIMIT": 50,
+    # 应用前的反向代理层数, 为0时只使用REMOTE_ADDR, 不信任客户端可伪造的X-Forwarded-For
+    "NUM_PROXIES": 0,
+}
+IDENTIFIER_KEY = "login:fail:user:{}"
+IP_KEY = "login:fail:ip:{}"
+
+# 清理窗口外的记录, 返回每个key的 [失败次数, 最早一次失败的时间]
+CHECK_SCRIPT = """
+local result = {}
+for i, key in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', tonumber(ARGV[1]) - tonumber(ARGV[2]))
+    local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+    result[#result + 1] = redis.call('ZCARD', key)
+    result[#result + 1] = oldest[2] or '0'
+end
+return result
+"""
+
+# 记录一次失败, 返回每个key的失败次数
+RECORD_SCRIPT = """
+local result = {}
+for i, key in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', tonumber(ARGV[1]) - tonumber(ARGV[2]))
+    redis.call('ZADD', key, ARGV[1], ARGV[3])
+    redis.call('PEXPIRE', key, math.ceil(tonumber(ARGV[2]) * 1000))
+    result[#result + 1] = redis.call('ZCARD', key)
+end
+return result
+"""
+
+
+class LoginLocked(Throttled):
+    default_detail = "登录失败次数过多, 请稍后重试"
+
+
+class LocalSlidingWindow:
+    """
+    进程内滑动窗口, 非redis缓存或redis不可用时使用
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _window(self, key, now, window):
+        events = self._windows.get(key)
+        if events is None:
+            events = self._windows[key] = deque()
+            while len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+        self._windows.move_to_end(key)
+        while events and events[0] <= now - window:
+            events.popleft()
+        return events
+
+    def check(self, keys, now, window):
+        with self._lock:
+            result = []
+            for key in keys:
+                events = self._window(key, now, window)
+                result.append((len(events), events[0] if events else 0))
+            return result
+
+    def record(self, keys, now, window):
+        with self._lock:
+            result = []
+            for key in keys:
+                events = self._window(key, now, window)
+                events.append(now)
+                result.append(len(events))
+            return result
+
+    def reset(self, keys):
+        with self._lock:
+            for key in keys:
+                self._windows.pop(key, None)
+
+
+class RedisSlidingWindow:
+    """
+    redis有序集合实现的滑动窗口, 每次检查或记录为一次原子的lua脚本调用
+    """
+
+    def __init__(self, alias="default"):
+        self.alias = alias
+        self._scripts = None
+
+    def _client(self):
+        from django_redis import get_redis_connection
+
+        return get_redis_connection(self.alias)
+
+    def _get_scripts(self):
+        if self._scripts is None:
+            client = self._client()
+            self._scripts = (
+                client.register_script(CHECK_SCRIPT),
+                client.register_script(RECORD_SCRIPT),
+            )
+        return self._scripts
+
+    def check(self, keys, now, window):
+        values = self._get_scripts()[0](
+            keys=[cache.make_key(key) for key in keys], args=[now, window]
+        )
+        return [
+            (int(values[i]), float(values[i + 1])) for i in range(0, len(values), 2)
+        ]
+
+    def record(self, keys, now, window):
+        values = self._get_scripts()[1](
+            keys=[cache.make_key(key) for key in keys],
+            args=[now, window, uuid.uuid4().hex],
+        )
+        return [int(value) for value in values]
+
+    def reset(self, keys):
+        self._client().delete(*[cache.make_key(key) for key in keys])
+
+
+class LoginLimiter:
+    """
+    按登录标识与IP统计窗口内的失败次数, 超过限制时在解密与密码校验之前拒绝登录
+    redis出错时降级为进程内计数
+    """
+
+    def __init__(self, backend, window, identifier_limit, ip_limit, num_proxies=0):
+        """
+        Args:
+            backend: 滑动窗口实现, RedisSlidingWindow 或 LocalSlidingWindow
+            window: 窗口长度(秒)
+            identifier_limit: 同一登录标识允许的失败次数
+            ip_limit: 同一IP允许的失败次数
+            num_proxies: 应用前的反向代理层数
+        """
+        self.backend = backend
+        self.fallback = (
+            backend if isinstance(backend, LocalSlidingWindow) else LocalSlidingWindow()
+        )
+        self.window = window
+        self.identifier_limit = identifier_limit
+        self.ip_limit = ip_limit
+        self.num_proxies = num_proxies
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.blocked = 0
+        self.failures = 0
+        self.fallbacks = 0
+
+    @staticmethod
+    def identifier_key(identifier):
+        return IDENTIFIER_KEY.format(hashlib.md5(identifier.encode()).hexdigest())
+
+    @staticmethod
+    def ip_key(ip):
+        return IP_KEY.format(hashlib.md5(ip.encode()).hexdigest())
+
+    def client_ip(self, request):
+        """
+        客户端IP
+        配置了num_proxies时取X-Forwarded-For中由最外层代理追加的地址, 否则只使用REMOTE_ADDR
+        Returns: 规范化后的IP, 不是合法IP时返回None
+        """
+        addr = request.META.get("REMOTE_ADDR")
+        forwarded = request.META.get("HTTP_X_FORWARDED_FOR")
+        if self.num_proxies and forwarded:
+            addrs = [item.strip() for item in forwarded.split(",")]
+            addr = addrs[-min(self.num_proxies, len(addrs))]
+        try:
+            return str(ipaddress.ip_address(addr))
+        except ValueError:
+            return None
+
+    def _keys(self, identifier, ip):
+        keys = [(self.identifier_key(identifier), self.identifier_limit)]
+        if ip:
+            keys.append((self.ip_key(ip), self.ip_limit))
+        return keys
+
+    def _call(self, method, *args):
+        try:
+            return getattr(self.backend, method)(*args)
+        except Exception:
+            logger.exception("login limiter backend error, fall back to local window")
+            with self._lock:
+                self.fallbacks += 1
+            return getattr(self.fallback, method)(*args)
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def check(self, identifier, ip):
+        """
+        失败次数达到限制时抛出LoginLocked(429)
+        Args:
+            identifier: 登录标识
+            ip: 客户端IP
+        """
+        self._count("checked")
+        keys = self._keys(identifier, ip)
+        now = time.time()
+        windows = self._call("check", [key for key, _ in keys], now, self.window)
+        wait = 0
+        for (count, oldest), (_, limit) in zip(windows, keys):
+            if count >= limit:
+                wait = max(wait, oldest + self.window - now)
+        if wait > 0:
+            self._count("blocked")
+            raise LoginLocked(wait=math.ceil(wait))
+
+    def record_failure(self, identifier, ip):
+        """
+        Returns: 各key窗口内的失败次数
+        """
+        self._count("failures")
+        keys = [key for key, _ in self._keys(identifier, ip)]
+        return self._call("record", keys, time.time(), self.window)
+
+    def reset(self, identifier):
+        """
+        登录成功后清除登录标识的失败记录, IP的失败记录保留到窗口结束
+        """
+        self._call("reset", [self.identifier_key(identifier)])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": type(self.backend).__name__,
+                "window": self.window,
+                "identifier_limit": self.identifier_limit,
+                "ip_limit": self.ip_limit,
+                "checked": self.checked,
+                "blocked": self.blocked,
+                "failures": self.failures,
+                "fallbacks": self.fallbacks,
+            }
+
+
+def _build():
+    config = dict(DEFAULT_LOGIN_LIMIT, **getattr(settings, "LOGIN_LIMIT", {}))
+    if "django_redis" in settings.CACHES["default"]["BACKEND"]:
+        backend = RedisSlidingWindow()
+    else:
+        backend = LocalSlidingWindow()
+    return LoginLimiter(
+        backend,
+        config["WINDOW"],
+        config["IDENTIFIER_LIMIT"],
+        config["IP_LIMIT"],
+        config["NUM_PROXIES"],
+    )
+
+
+login_limiter = _build()
@@ -0,0 +1,33 @@
+# author:hao.lu
+# create_date: 10/21/2020 10:40 AM
+# file : backfill_dict_fullname.py
+# IDE: PyCharm
+
+# ! -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from apps.system.service import backfill_dict_fullname
+
+
+class Command(BaseCommand):
+    """
+    按主键区间分批重新计算数据字典的fullname, 中断后以输出的主键通过--start-id继续
+    example: python manage.py backfill_dict_fullname --chunk-size 10000 --start-id 200001
+    """
+
+    help = "Recompute Dict.fullname in primary key chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=10000)
+        parser.add_argument("--start-id", type=int, default=None)
+
+    def handle(self, *args, **options):
+        def progress(start, end, count):
+            self.stdout.write("dict_id [{}, {}): updated {}".format(start, end, count))
+
+        result = backfill_dict_fullname(
+            start_id=options["start_id"],
+            chunk_size=options["chunk_size"],
+            progress=progress,
+        )
+        self.stdout.write("updated {} dicts".format(result["updated"]))
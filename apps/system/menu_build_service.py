@@ -16,65 +16,52 @@
 
 from apps.system.models import Menu
 from apps.system.serializers import MenuSerializer
+from apps.system.service import menu_hierarchy
+from utils.tree_util import build_tree
 
 
 class MenuBuildSevice:
+    """
+    构建侧边栏菜单, 查询次数固定, 与菜单数量和层级无关
+    """
+
     def build(self, user):
-        all_menu = None
-        roles = user.roles.filter(is_activate=True)
-        for role in roles:
-            temp_menu = role.menus.filter(is_activate=True, sidebar=True, menu_type__in=[0, 1, 2]).order_by(
-                "menu_sort")
-            if all_menu is None:
-                all_menu = temp_menu
-            else:
-                all_menu = all_menu | temp_menu
+        """
+        Args:
+            user: 用户对象
+
+        Returns: 侧边栏树型结构菜单, 包含用户菜单的全部上级菜单
 
-        result = self.get_parent_menu_all(all_menu)
-        return result
+        """
+        menu_ids = (
+            Menu.objects.filter(
+                role__users=user,
+                role__is_activate=True,
+                is_activate=True,
+                sidebar=True,
+                menu_type__in=[0, 1, 2],
+            )
+            .values_list("menu_id", flat=True)
+            .distinct()
+        )
+        return self.get_parent_menu_all(list(menu_ids))
 
-    def get_parent_menu_all(self, menus):
-        # chilren_list = []
-        parent_dict = {}
-        parent_list = []
-        for menu in menus:
-            parent_menus = Menu.objects.filter(is_activate=True, sidebar=True, menu_id=menu.pid).first()
-            if len(parent_dict) == 0 or parent_menus.menu_id not in parent_dict.keys():
-                parent_dict["parent" + str(parent_menus.menu_id)] = MenuSerializer(parent_menus).data
-                parent_dict[parent_menus.menu_id] = [MenuSerializer(menu).data]
-                parent_list.append(parent_dict)
-            else:
-                child_list = parent_dict[parent_menus.menu_id]
-                child_list.append(MenuSerializer(menu).data)
-            if not self.is_exist(parent_list, parent_dict):
-                parent_dict["parent"] = MenuSerializer(parent_menus).data
-                parent_list.append(parent_dict)
-        result = self.get_parent(parent_list)
-        return result
+    def get_parent_menu_all(self, menu_ids):
+        """
+        一次查询加载菜单及其全部上级菜单, 通过menu_id索引挂载子菜单
+        上级菜单未激活或不在侧边栏显示时, 其下的菜单不再显示
+        Args:
+            menu_ids: 菜单ID集合
 
-    def get_parent(self, parent_list):
-        result_dict = {}
-        root_flag = False
-        for parent_dict in parent_list:
-            parent_menus = Menu.objects.filter(is_activate=True, sidebar=True,
-                                               menu_id=parent_dict["parent"]["pid"]).first()
-            if parent_menus.pid is None:
-                root_flag = True
-            if len(result_dict) == 0:
-                result_dict[parent_menus.menu_id] = [MenuSerializer(parent_menus).data]
-                result_dict["parent"] = MenuSerializer(parent_menus).data
-                parent_list.append(result_dict)
-            else:
-                child_list = result_dict[parent_menus.menu_id]
-                child_list.append(MenuSerializer(parent_menus).data)
-            if not self.is_exist(parent_list, result_dict):
-                result_dict["parent"] = MenuSerializer(parent_menus).data
-                parent_list.append(result_dict)
-        if root_flag:
-            return parent_list
-        else:
-            return self.get_parent(parent_list)
+        Returns: 树型结构菜单
 
-    def is_exist(self, result_list, result_dict):
-        return [True if menu["parent"]["menu_id"] == result_dict["parent"]["menu_id"] else False for menu in
-                result_list]
+        """
+        ids = menu_hierarchy.ancestor_ids_many(menu_ids)
+        if not ids:
+            return []
+        menus = Menu.objects.filter(
+            menu_id__in=ids, is_activate=True, sidebar=True
+        ).order_by("menu_sort")
+        nodes = MenuSerializer(menus, many=True).data
+        # 只返回从根菜单可达的节点, pid成环的数据不会出现在结果中
+        return build_tree(nodes, "menu_id")
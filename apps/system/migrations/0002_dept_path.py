@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+def backfill_dept_path(apps, schema_editor):
+    """
+    按层级回填部门物化路径
+    """
+    Dept = apps.get_model("system", "Dept")
+    paths = {}
+    level = list(Dept.objects.filter(pid__isnull=True))
+    while level:
+        for dept in level:
+            dept.path = "{}{}/".format(paths.get(dept.pid, "/"), dept.pk)
+            paths[dept.pk] = dept.path
+        Dept.objects.bulk_update(level, ["path"], batch_size=1000)
+        level = list(
+            Dept.objects.filter(pid__in=[dept.pk for dept in level]).exclude(
+                pk__in=list(paths)
+            )
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('system', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dept',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255, verbose_name='物化路径'),
+        ),
+        migrations.RunPython(backfill_dept_path, migrations.RunPython.noop),
+    ]
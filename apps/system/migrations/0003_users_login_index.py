@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('system', '0002_dept_path'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='users',
+            name='phone',
+            field=models.CharField(db_index=True, max_length=255, null=True, verbose_name='手机号'),
+        ),
+        migrations.AlterField(
+            model_name='users',
+            name='email',
+            field=models.CharField(db_index=True, max_length=255, null=True, verbose_name='邮箱'),
+        ),
+    ]
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('system', '0003_users_login_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dept',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, max_length=255, null=True, verbose_name='物化路径'),
+        ),
+    ]
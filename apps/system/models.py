@@ -2,8 +2,11 @@ import django.utils.timezone as timezone
 from django.contrib.auth.models import AbstractBaseUser
 from django.contrib.auth.models import BaseUserManager
 from django.db import models
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
 
 from utils.baseModel import SoftModel
+from utils.hierarchy import Hierarchy
 
 
 class Position(SoftModel):
@@ -35,6 +38,9 @@ class Dept(SoftModel):
     sub_count = models.IntegerField("子部门数目", default=0)
     dept_name = models.CharField("名称", max_length=255)
     dept_sort = models.IntegerField("排序", default=999)
+    path = models.CharField(
+        "物化路径", max_length=255, null=True, blank=True, db_index=True
+    )
 
     class Meta:
         managed = True
@@ -45,6 +51,86 @@ class Dept(SoftModel):
     def __str__(self):
         return self.dept_name
 
+    @staticmethod
+    def path_pid(path):
+        """
+        从物化路径中解析父部门ID, example: /1/4/6/ -> 4
+        """
+        parts = path.strip("/").split("/")
+        return int(parts[-2]) if len(parts) > 1 else None
+
+    def in_subtree(self, pid):
+        """
+        pid是否为本部门或其子部门, 上级部门改为pid时会成环
+        双方都有路径时比较路径前缀, 否则沿pid向上查找祖先
+        """
+        if pid is None or self.pk is None:
+            return False
+        if pid == self.pk:
+            return True
+        parent_path = Dept.objects.filter(pk=pid).values_list("path", flat=True).first()
+        if self.path and parent_path:
+            return parent_path.startswith(self.path)
+        return self.pk in Hierarchy(Dept).ancestor_ids(pid)
+
+    def build_path(self):
+        """
+        Returns: 物化路径, 上级部门没有路径(初始化sql导入的数据)时返回None, 查询子集时按上级关系查找
+        """
+        if self.in_subtree(self.pid):
+            raise ValueError("部门不能移动到自身或其子部门下")
+        parent_path = "/"
+        if self.pid:
+            parent_path = (
+                Dept.objects.filter(pk=self.pid).values_list("path", flat=True).first()
+            )
+            if not parent_path:
+                return None
+        return "{}{}/".format(parent_path, self.pk)
+
+    def _rebuild_descendant_paths(self):
+        # 按上级关系逐层生成子部门路径, 用于原本没有路径的子树
+        paths = {self.pk: self.path}
+        level = list(Dept.objects.filter(pid=self.pk))
+        while level:
+            for dept in level:
+                dept.path = "{}{}/".format(paths[dept.pid], dept.pk)
+                paths[dept.pk] = dept.path
+            Dept.objects.bulk_update(level, ["path"], batch_size=1000)
+            level = list(
+                Dept.objects.filter(pid__in=[dept.pk for dept in level]).exclude(
+                    pk__in=list(paths)
+                )
+            )
+
+    def save(self, *args, **kwargs):
+        """
+        维护物化路径 /根部门ID/.../本部门ID/, 上级部门变更时一并更新全部子部门
+        新的上级部门没有路径时整棵子树的路径置为NULL, 不保留相对路径
+        通过QuerySet.update修改pid不会维护路径
+        """
+        old_path = self.path
+        if old_path and self.path_pid(old_path) == self.pid:
+            super().save(*args, **kwargs)
+            return
+        adding = self._state.adding
+        if old_path:
+            self.path = self.build_path()
+            super().save(*args, **kwargs)
+            descendants = Dept.objects.filter(path__startswith=old_path).exclude(pk=self.pk)
+            if self.path:
+                descendants.update(
+                    path=Concat(Value(self.path), Substr("path", len(old_path) + 1))
+                )
+            else:
+                descendants.update(path=None)
+        else:
+            super().save(*args, **kwargs)
+            self.path = self.build_path()
+            Dept.objects.filter(pk=self.pk).update(path=self.path)
+            if self.path and not adding:
+                self._rebuild_descendant_paths()
+
 
 class Menu(SoftModel):
     """
@@ -119,8 +205,8 @@ class Users(AbstractBaseUser):
     USERNAME_FIELD = "user_name"
     nick_name = models.CharField("昵称", max_length=255)
     gender = models.CharField("性别 1:男,2:女", max_length=2, null=True)
-    phone = models.CharField("手机号", max_length=255, null=True)
-    email = models.CharField("邮箱", max_length=255, null=True)
+    phone = models.CharField("手机号", max_length=255, null=True, db_index=True)
+    email = models.CharField("邮箱", max_length=255, null=True, db_index=True)
     avatar_name = models.CharField(
         "头像地址", max_length=1000, null=True, blank=True, db_index=True
     )
@@ -0,0 +1,129 @@
+# author:hao.lu
+# create_date: 10/12/2020 10:30 AM
+# file : perm_cache.py
+# IDE: PyCharm
+
+# ! -*- coding: utf-8 -*-
+from utils.cache_version import bump_version, get_version, get_versions
+from .models import Menu
+from .session_store import session_store
+
+# 全局权限版本号, 菜单或角色变更时递增
+PERMS_VERSION = "perm"
+# 单个角色的版本号, 角色及其菜单变更时递增
+ROLE_VERSION = "perm:role:{}"
+
+
+def compute_permissions(user):
+    """
+    单条关联查询计算用户权限
+    Args:
+        user: 用户对象
+
+    Returns: frozenset 权限集合
+
+    """
+    if user.is_admin:
+        return frozenset(["admin"])
+    perms = (
+        Menu.objects.filter(role__users=user)
+        .exclude(permission__isnull=True)
+        .exclude(permission="")
+        .values_list("permission", flat=True)
+        .distinct()
+    )
+    return frozenset(perms)
+
+
+def resolve_permissions(user, record, version):
+    """
+    根据会话记录解析权限, 记录中的版本号与全局版本号一致时直接返回, 否则重新计算
+    Args:
+        user: 用户对象
+        record: session_store中的会话记录, 可为None
+        version: 全局权限版本号, 可为None
+
+    Returns: frozenset 权限集合
+
+    """
+    if version is None:
+        version = get_version(PERMS_VERSION)
+    if record and record["perms"] is not None and record["ver"] == version:
+        return record["perms"]
+    perms = compute_permissions(user)
+    if record:
+        session_store.set_perms(user.id, perms, version)
+    return perms
+
+
+def get_user_permissions(user):
+    """
+    读取用户权限
+    Args:
+        user: 用户对象
+
+    Returns: frozenset 权限集合
+
+    """
+    record, version = session_store.load(user.id, PERMS_VERSION)
+    return resolve_permissions(user, record, version)
+
+
+def open_session(user, jti, timeout):
+    """
+    登录时写入会话记录, 同时缓存当前权限
+    Args:
+        user: 用户对象
+        jti: access token的jti, 作为token指纹
+        timeout: 会话过期时间(秒)
+
+    Returns: frozenset 权限集合
+
+    """
+    version = get_version(PERMS_VERSION)
+    perms = compute_permissions(user)
+    session_store.open(user.id, jti, perms, version, timeout)
+    return perms
+
+
+def close_session(user_id):
+    session_store.close(user_id)
+
+
+def get_role_versions(role_ids):
+    """
+    批量读取角色版本号
+    Args:
+        role_ids: 角色ID集合
+
+    Returns: {role_id: version}
+
+    """
+    names = {ROLE_VERSION.format(role_id): role_id for role_id in role_ids}
+    versions = get_versions(names)
+    return {role_id: versions[name] for name, role_id in names.items()}
+
+
+def invalidate_user(user_id):
+    session_store.drop_perms([user_id])
+
+
+def invalidate_users(user_ids):
+    session_store.drop_perms(user_ids)
+
+
+def invalidate_role(role_id):
+    """
+    角色或其菜单变更, 递增角色版本号与全局版本号
+    """
+    bump_version(ROLE_VERSION.format(role_id))
+    bump_version(PERMS_VERSION)
+    session_store.flush_local()
+
+
+def invalidate_all():
+    """
+    菜单权限标识变更, 全部用户权限失效
+    """
+    bump_version(PERMS_VERSION)
+    session_store.flush_local()
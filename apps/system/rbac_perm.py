@@ -1,31 +1,18 @@
-from django.core.cache import cache
-from jwt import decode as jwt_decode
+from django.db.models import Q
 from rest_framework.permissions import BasePermission
+from rest_framework_simplejwt.settings import api_settings
 
-from server.settings import SECRET_KEY
 from utils.querySetUtil import get_child_queryset2
-from .models import Menu
+from .models import Dept
+from .perm_cache import PERMS_VERSION, get_user_permissions, resolve_permissions
+from .session_store import session_store
 
 
 def get_permission_list(user):
     """
-    获取权限列表,可用redis存取
+    获取权限列表,由perm_cache按版本号缓存
     """
-    if user.is_admin:
-        perms_list = ["admin"]
-    else:
-        perms = Menu.objects.none()
-        roles = user.roles.all()
-        if roles:
-            for i in roles:
-                perms = perms | i.menus.all()
-        perms_list = perms.values_list("permission", flat=True)
-        # filter null value
-        perms_list = list(filter(lambda a: (a), perms_list))
-        perms_list = list(set(perms_list))
-    cache.set(user.user_name + "__perms", perms_list)
-    # cache.persist(user.user_name)
-    return perms_list
+    return sorted(get_user_permissions(user))
 
 
 class RbacPermission(BasePermission):
@@ -40,23 +27,21 @@ class RbacPermission(BasePermission):
         :param view:
         :return:
         """
-        if not request.user:
+        if not request.user or request.auth is None:
             return False
-        else:
-            perms = cache.get(request.user.user_name + "__perms")
-        token = cache.get(request.user.user_name + "__token")
-        if token:
-            try:
-                decoded_data = jwt_decode(token, SECRET_KEY, algorithms=["HS256"])
-                user_id = decoded_data.get("user_id")
-                if request.user.id != user_id:
-                    return False
-            except Exception:
-                return False
-        else:
+        # request.auth 为JWTAuthentication已校验过的token, 直接使用其声明, 不再二次解码
+        try:
+            user_id = request.auth[api_settings.USER_ID_CLAIM]
+            jti = request.auth[api_settings.JTI_CLAIM]
+        except (KeyError, TypeError):
             return False
-        if not perms:
-            perms = get_permission_list(request.user)
+        record, version = session_store.load(request.user.id, PERMS_VERSION)
+        if record is None or record["user_id"] != user_id or request.user.id != user_id:
+            return False
+        # 只有最近一次登录签发的token有效
+        if record["jti"] != jti:
+            return False
+        perms = resolve_permissions(request.user, record, version)
         if perms:
             if "admin" in perms:
                 return True
@@ -65,13 +50,14 @@ class RbacPermission(BasePermission):
             else:
                 perms_map = view.perms_map
                 _method = request._request.method.lower()
-                action = view.action
+                # APIView没有action, 按perms_map中的权限标识校验
+                action = getattr(view, "action", None)
                 if perms_map:
                     for key in perms_map:
                         if key == _method or key == "*":
                             if action and (action in perms or perms_map[key] == "*"):
                                 return True
-                            elif action in ["create", "update", "delete", "list"] and (
+                            elif action in [None, "create", "update", "delete", "list"] and (
                                     perms_map[key] in perms or perms_map[key] == "*"
                             ):
                                 return True
@@ -90,6 +76,59 @@ class RbacPermission(BasePermission):
         return True
 
 
+def get_data_scope_depts(user):
+    """
+    按用户所有角色的数据权限取并集, 计算可访问的部门
+    Args:
+        user: 用户对象
+
+    Returns: None 表示全部部门, 否则为部门QuerySet(为空时仅本人)
+
+    """
+    if user.is_admin:
+        return None
+    roles = list(user.roles.filter(is_deleted=False).values_list("role_id", "data_scope"))
+    scopes = {data_scope for _, data_scope in roles}
+    if "全部" in scopes:
+        return None
+    condition = Q()
+    custom_roles = [role_id for role_id, data_scope in roles if data_scope == "自定义"]
+    if custom_roles:
+        condition |= Q(role__in=custom_roles)
+    dept = user.dept if user.dept_id else None
+    if dept is not None:
+        if "同级及以下" in scopes:
+            parent = Dept.objects.filter(pk=dept.pid).first() if dept.pid else None
+            condition |= Q(pk__in=get_child_queryset2(parent or dept))
+        if "本级及以下" in scopes:
+            condition |= Q(pk__in=get_child_queryset2(dept))
+        if "本级" in scopes:
+            condition |= Q(pk=dept.pk)
+    if not condition:
+        return Dept.objects.none()
+    return Dept.objects.filter(condition, is_deleted=False).distinct()
+
+
+def filter_data_scope(queryset, user, dept_field="dept", user_field="pk"):
+    """
+    按数据权限过滤查询集
+    Args:
+        queryset: 查询集
+        user: 当前用户
+        dept_field: 数据所属部门字段
+        user_field: 数据所属用户字段, 仅本人时按该字段过滤
+
+    Returns: 过滤后的查询集
+
+    """
+    depts = get_data_scope_depts(user)
+    if depts is None:
+        return queryset
+    return queryset.filter(
+        Q(**{dept_field + "__in": depts}) | Q(**{user_field: user.pk})
+    )
+
+
 def has_obj_perm(user, obj):
     """
     数据权限控权
@@ -1,13 +1,12 @@
 import re
 
-from django.core.cache import cache
-from django.db.models import Q
 from jwt import decode as jwt_decode
-from rest_framework import serializers
+from rest_framework import exceptions, serializers
 from rest_framework_simplejwt.serializers import (
     TokenObtainPairSerializer,
     TokenVerifySerializer,
 )
+from rest_framework_simplejwt.settings import api_settings
 
 from server.settings import SECRET_KEY
 from utils.constant import E_MAIL_REGULAR, PHONE_REGULAR
@@ -19,14 +18,17 @@ from utils.constant import (
     JSON_ACCOUNT_VALIDATION_ERROR,
     JSON_ROLE_VALIDATION_ERROR,
     JSON_MENU_VALIDATION_ERROR,
+    JSON_DEPT_PID_ERROR,
     JSON_DEPT_VALIDATION_ERROR,
     JSON_POSITION_VALIDATION_ERROR,
     JSON_DICT_VALIDATION_ERROR,
     JSON_DICT_TYPE_VALIDATION_ERROR,
     JSON_DICT_TYPE_CODE_VALIDATION_ERROR,
 )
+from utils.unique_validation import UniqueFieldsMixin, UniqueListSerializer
+from .login_limiter import login_limiter
 from .models import Dict, DictType, Dept, Menu, Role, Users, Position
-from .rbac_perm import get_permission_list
+from .perm_cache import open_session
 
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
@@ -35,12 +37,27 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
     """
 
     def validate(self, attrs):
-        data = super().validate(attrs)
+        identifier = attrs[self.username_field]
+        request = self.context.get("request")
+        ip = login_limiter.client_ip(request) if request is not None else None
+        # 失败次数超限时直接拒绝, 不再解密与校验密码
+        login_limiter.check(identifier, ip)
+        try:
+            data = super().validate(attrs)
+        except exceptions.AuthenticationFailed:
+            login_limiter.record_failure(identifier, ip)
+            raise
+        login_limiter.reset(identifier)
         refresh = self.get_token(self.user)
-        perms = get_permission_list(self.user)
         access_token = refresh.access_token
+        perms = sorted(
+            open_session(
+                self.user,
+                access_token[api_settings.JTI_CLAIM],
+                api_settings.ACCESS_TOKEN_LIFETIME.total_seconds(),
+            )
+        )
         token = "Bearer " + str(access_token)
-        cache.set(self.user.user_name + "__token", str(access_token), 60 * 60 * 24)
         user_serializer = UserListSerializer(self.user)
 
         data["token"] = token
@@ -69,180 +86,110 @@ class MyTokenVerifySerializer(TokenVerifySerializer):
         return decoded_data
 
 
-class DictTypeSerializer(serializers.ModelSerializer):
+class DictTypeSerializer(UniqueFieldsMixin, serializers.ModelSerializer):
     """
     数据字典类型序列化
     """
 
     dict_type_name = serializers.CharField(required=True)
     code = serializers.CharField(required=True)
-    dict_type_id = None
+    unique_fields = {
+        "dict_type_name": JSON_DICT_TYPE_VALIDATION_ERROR,
+        "code": JSON_DICT_TYPE_CODE_VALIDATION_ERROR,
+    }
 
     class Meta:
         model = DictType
         fields = "__all__"
+        list_serializer_class = UniqueListSerializer
 
-    def validate_dict_type_name(self, dict_type_name):
-        if "dict_type_id" not in self.initial_data.keys():
-            if DictType.objects.filter(dict_type_name=dict_type_name).count() > 0:
-                raise serializers.ValidationError(JSON_DICT_TYPE_VALIDATION_ERROR)
-        else:
-            self.dict_type_id = self.initial_data["dict_type_id"]
-        if (
-            DictType.objects.filter(
-                ~Q(dict_type_id=self.dict_type_id), dict_type_name=dict_type_name
-            ).count()
-            > 0
-        ):
-            raise serializers.ValidationError(JSON_DICT_TYPE_VALIDATION_ERROR)
-        return dict_type_name
-
-    def validate_code(self, code):
-        if DictType.objects.filter(code=code):
-            raise serializers.ValidationError(JSON_DICT_TYPE_CODE_VALIDATION_ERROR)
-        else:
-            self.code = self.initial_data["code"]
-        if DictType.objects.filter(~Q(code=self.code), code=code).count() > 0:
-            raise serializers.ValidationError(JSON_DICT_TYPE_CODE_VALIDATION_ERROR)
-        return code
-
-
-class DictSerializer(serializers.ModelSerializer):
+
+class DictSerializer(UniqueFieldsMixin, serializers.ModelSerializer):
     """
     数据字典序列化
     """
 
     dict_name = serializers.CharField(required=True)
-
-    dict_id = None
+    unique_fields = {"dict_name": JSON_DICT_VALIDATION_ERROR}
 
     # fullname = serializers.SerializerMethodField(read_only=True)
     class Meta:
         model = Dict
         fields = "__all__"
+        list_serializer_class = UniqueListSerializer
+        # dict_name全局唯一已覆盖(dict_name, dict_type)联合唯一
+        validators = []
 
-    def validate_dict_name(self, dict_name):
-        if "dict_id" not in self.initial_data.keys():
-            if Dict.objects.filter(dict_name=dict_name).count() > 0:
-                raise serializers.ValidationError(JSON_DICT_VALIDATION_ERROR)
-        else:
-            self.dict_id = self.initial_data["dict_id"]
-        if (
-            Dict.objects.filter(~Q(dict_id=self.dict_id), dict_name=dict_name).count()
-            > 0
-        ):
-            raise serializers.ValidationError(JSON_DICT_VALIDATION_ERROR)
-        return dict_name
-
-
-class PositionSerializer(serializers.ModelSerializer):
+
+class PositionSerializer(UniqueFieldsMixin, serializers.ModelSerializer):
     """
     职位/岗位序列化
     """
 
     position_name = serializers.CharField(required=True)
 
-    position_id = None
+    unique_fields = {"position_name": JSON_POSITION_VALIDATION_ERROR}
 
     class Meta:
         model = Position
         fields = "__all__"
+        list_serializer_class = UniqueListSerializer
+
 
-    def validate_position_name(self, position_name):
-        if "position_id" not in self.initial_data.keys():
-            if Position.objects.filter(position_name=position_name).count() > 0:
-                raise serializers.ValidationError(JSON_POSITION_VALIDATION_ERROR)
-        else:
-            self.position_id = self.initial_data["position_id"]
-        if (
-            Position.objects.filter(
-                ~Q(position_id=self.position_id), position_name=position_name
-            ).count()
-            > 0
-        ):
-            raise serializers.ValidationError(JSON_POSITION_VALIDATION_ERROR)
-        return position_name
-
-
-class DeptSerializer(serializers.ModelSerializer):
+class DeptSerializer(UniqueFieldsMixin, serializers.ModelSerializer):
     """
     部门序列化
     """
 
     dept_name = serializers.CharField(required=True)
 
-    dept_id = None
+    unique_fields = {"dept_name": JSON_DEPT_VALIDATION_ERROR}
 
     class Meta:
         model = Dept
         fields = "__all__"
+        list_serializer_class = UniqueListSerializer
+        read_only_fields = ["path"]
+
+    def validate_pid(self, value):
+        """
+        上级部门不能是自身或其子部门
+        """
+        if value is None or self.instance is None:
+            return value
+        if self.instance.in_subtree(value):
+            raise serializers.ValidationError(JSON_DEPT_PID_ERROR)
+        return value
+
 
-    def validate_dept_name(self, dept_name):
-        if "dept_id" not in self.initial_data.keys():
-            if Dept.objects.filter(dept_name=dept_name).count() > 0:
-                raise serializers.ValidationError(JSON_DEPT_VALIDATION_ERROR)
-        else:
-            self.dept_id = self.initial_data["dept_id"]
-        if (
-            Dept.objects.filter(~Q(dept_id=self.dept_id), dept_name=dept_name).count()
-            > 0
-        ):
-            raise serializers.ValidationError(JSON_DEPT_VALIDATION_ERROR)
-        return dept_name
-
-
-class MenuSerializer(serializers.ModelSerializer):
+class MenuSerializer(UniqueFieldsMixin, serializers.ModelSerializer):
     """
     菜单序列化
     """
 
     menu_name = serializers.CharField(required=True)
 
-    menu_id = None
+    unique_fields = {"menu_name": JSON_MENU_VALIDATION_ERROR}
 
     class Meta:
         model = Menu
         fields = "__all__"
+        list_serializer_class = UniqueListSerializer
 
-    def validate_menu_name(self, menu_name):
-        if "menu_id" not in self.initial_data.keys():
-            if Menu.objects.filter(menu_name=menu_name).count() > 0:
-                raise serializers.ValidationError(JSON_MENU_VALIDATION_ERROR)
-        else:
-            self.menu_id = self.initial_data["menu_id"]
-        if (
-            Menu.objects.filter(~Q(menu_id=self.menu_id), menu_name=menu_name).count()
-            > 0
-        ):
-            raise serializers.ValidationError(JSON_MENU_VALIDATION_ERROR)
-        return menu_name
-
-
-class RoleSerializer(serializers.ModelSerializer):
+
+class RoleSerializer(UniqueFieldsMixin, serializers.ModelSerializer):
     """
     角色序列化
     """
 
     role_name = serializers.CharField(required=True)
     # menus = MenuSerializer(many=True, read_only=True)
-    role_id = None
+    unique_fields = {"role_name": JSON_ROLE_VALIDATION_ERROR}
 
     class Meta:
         model = Role
         fields = "__all__"
-
-    def validate_role_name(self, role_name):
-        if "role_id" not in self.initial_data.keys():
-            if Role.objects.filter(role_name=role_name).count() > 0:
-                raise serializers.ValidationError(JSON_ROLE_VALIDATION_ERROR)
-        else:
-            self.role_id = self.initial_data["role_id"]
-        if (
-            Role.objects.filter(~Q(role_id=self.role_id), role_name=role_name).count()
-            > 0
-        ):
-            raise serializers.ValidationError(JSON_ROLE_VALIDATION_ERROR)
-        return role_name
+        list_serializer_class = UniqueListSerializer
 
 
 class UserLoginSerializer(serializers.ModelSerializer):
@@ -288,6 +235,13 @@ class UserListSerializer(serializers.ModelSerializer):
     position_name = serializers.StringRelatedField(source="position")
     roles_name = serializers.StringRelatedField(source="roles", many=True)
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        一次取出部门、岗位, 角色单独一次查询, 查询数与用户数无关
+        """
+        return queryset.select_related("dept", "position").prefetch_related("roles")
+
     class Meta:
         model = Users
         fields = [
@@ -316,12 +270,11 @@ class UserListSerializer(serializers.ModelSerializer):
         ]
 
 
-class UserModifySerializer(serializers.ModelSerializer):
+class UserModifySerializer(UniqueFieldsMixin, serializers.ModelSerializer):
     """
     用户编辑序列化
     """
 
-    user_id = None
     user_name = serializers.CharField(required=True)
     phone = serializers.CharField(max_length=255, required=True)
     email = serializers.CharField(max_length=255, required=True)
@@ -331,9 +284,17 @@ class UserModifySerializer(serializers.ModelSerializer):
     dept_name = serializers.StringRelatedField(source="dept", read_only=True)
     position_name = serializers.StringRelatedField(source="position", read_only=True)
     roles_name = serializers.StringRelatedField(source="roles", many=True, read_only=True)
+    unique_fields = {
+        "user_name": JSON_ACCOUNT_VALIDATION_ERROR,
+        "phone": JSON_PHONE_REGISTERED_VALIDATION_ERROR,
+        "email": JSON_EMAIL_REGISTERED_VALIDATION_ERROR,
+    }
 
     class Meta:
         model = Users
+        list_serializer_class = UniqueListSerializer
+        # 各字段唯一已覆盖(user_name, phone, email)联合唯一
+        validators = []
         fields = [
             "id",
             "user_name",
@@ -353,35 +314,18 @@ class UserModifySerializer(serializers.ModelSerializer):
             "dept_name",
         ]
 
-    def validate_user_name(self, user_name):
-        if self.user_id is None:
-            self.user_id = self.initial_data["id"]
-        if Users.objects.filter(~Q(id=self.user_id), user_name=user_name).count() > 0:
-            raise serializers.ValidationError(JSON_ACCOUNT_VALIDATION_ERROR)
-        return user_name
-
     def validate_phone(self, phone):
-        re_phone = PHONE_REGULAR
-        if self.user_id is None:
-            self.user_id = self.initial_data["id"]
-        if not re.match(re_phone, phone):
+        if not re.match(PHONE_REGULAR, phone):
             raise serializers.ValidationError(JSON_PHONE_FORMAT_VALIDATION_ERROR)
-        if Users.objects.filter(~Q(id=self.user_id), phone=phone).count() > 0:
-            raise serializers.ValidationError(JSON_PHONE_REGISTERED_VALIDATION_ERROR)
         return phone
 
     def validate_email(self, email):
-        re_email = E_MAIL_REGULAR
-        if self.user_id is None:
-            self.user_id = self.initial_data["id"]
-        if not re.match(re_email, email):
+        if not re.match(E_MAIL_REGULAR, email):
             raise serializers.ValidationError(JSON_EMAIL_FORMAT_VALIDATION_ERROR)
-        if Users.objects.filter(~Q(id=self.user_id), email=email).count() > 0:
-            raise serializers.ValidationError(JSON_EMAIL_REGISTERED_VALIDATION_ERROR)
         return email
 
 
-class UserCreateSerializer(serializers.ModelSerializer):
+class UserCreateSerializer(UniqueFieldsMixin, serializers.ModelSerializer):
     """
     创建用户序列化
     """
@@ -391,9 +335,16 @@ class UserCreateSerializer(serializers.ModelSerializer):
     dept = serializers.PrimaryKeyRelatedField(queryset=Dept.objects.all())
     position = serializers.PrimaryKeyRelatedField(queryset=Position.objects.all())
     roles = serializers.PrimaryKeyRelatedField(many=True, queryset=Role.objects.all())
+    unique_fields = {
+        "user_name": JSON_ACCOUNT_VALIDATION_ERROR,
+        "phone": JSON_PHONE_REGISTERED_VALIDATION_ERROR,
+        "email": JSON_EMAIL_REGISTERED_VALIDATION_ERROR,
+    }
 
     class Meta:
         model = Users
+        list_serializer_class = UniqueListSerializer
+        validators = []
         fields = [
             "id",
             "user_name",
@@ -411,23 +362,49 @@ class UserCreateSerializer(serializers.ModelSerializer):
             "roles",
         ]
 
-    def validate_user_name(self, user_name):
-        if Users.objects.filter(user_name=user_name):
-            raise serializers.ValidationError(JSON_ACCOUNT_VALIDATION_ERROR)
-        return user_name
-
     def validate_phone(self, phone):
-        re_phone = PHONE_REGULAR
-        if not re.match(re_phone, phone):
+        if not re.match(PHONE_REGULAR, phone):
             raise serializers.ValidationError(JSON_PHONE_FORMAT_VALIDATION_ERROR)
-        if Users.objects.filter(phone=phone):
-            raise serializers.ValidationError(JSON_PHONE_REGISTERED_VALIDATION_ERROR)
         return phone
 
     def validate_email(self, email):
-        re_email = E_MAIL_REGULAR
-        if not re.match(re_email, email):
+        if not re.match(E_MAIL_REGULAR, email):
             raise serializers.ValidationError(JSON_EMAIL_FORMAT_VALIDATION_ERROR)
-        if Users.objects.filter(email=email):
-            raise serializers.ValidationError(JSON_EMAIL_REGISTERED_VALIDATION_ERROR)
         return email
+
+
+class UserImportSerializer(serializers.Serializer):
+    """
+    批量导入用户的单行校验, 只校验格式, 唯一性与关联对象由UserImporter按集合一次查询
+    """
+
+    user_name = serializers.CharField(max_length=255)
+    nick_name = serializers.CharField(max_length=255)
+    gender = serializers.CharField(max_length=2, required=False, allow_null=True, allow_blank=True)
+    phone = serializers.CharField(max_length=11)
+    email = serializers.CharField(max_length=255, required=False, allow_null=True, allow_blank=True)
+    dept = serializers.IntegerField(required=False, allow_null=True)
+    position = serializers.IntegerField(required=False, allow_null=True)
+    roles = serializers.ListField(child=serializers.IntegerField(), required=False)
+    is_activate = serializers.BooleanField(default=True)
+    password = serializers.CharField(required=False, allow_blank=True, write_only=True)
+
+    def validate_phone(self, phone):
+        if not re.match(PHONE_REGULAR, phone):
+            raise serializers.ValidationError(JSON_PHONE_FORMAT_VALIDATION_ERROR)
+        return phone
+
+    def validate_email(self, email):
+        if email and not re.match(E_MAIL_REGULAR, email):
+            raise serializers.ValidationError(JSON_EMAIL_FORMAT_VALIDATION_ERROR)
+        return email or None
+
+
+class DictCorrectSerializer(serializers.Serializer):
+    """
+    数据字典fullname分批重新计算的参数, 每次请求的批数有上限
+    """
+
+    start_id = serializers.IntegerField(required=False, allow_null=True, min_value=0)
+    chunk_size = serializers.IntegerField(default=10000, min_value=1, max_value=100000)
+    max_chunks = serializers.IntegerField(default=10, min_value=1, max_value=100)
@@ -3,14 +3,32 @@
 # file : service.py
 # IDE: PyCharm
 
+import hashlib
 import logging
+from collections import defaultdict
 
 # ! -*- coding: utf-8 -*-
-from apps.system.models import Menu, Dept
-from apps.system.serializers import MenuSerializer, DeptSerializer
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import CharField, F, Max, Min, Value
+from django.db.models.functions import Concat, StrIndex
+
+from apps.system.models import Menu, Dept, DictType, Dict, Users
+from apps.system.perm_cache import ROLE_VERSION
+from apps.system.serializers import MenuSerializer, DeptSerializer, DictSerializer
+from utils.baseResponse import RawJSON, encode_json
+from utils.cache_version import bump_version, get_version, get_versions
+from utils.local_cache import MISSING, local_cache
+from utils.hierarchy import Hierarchy
+from utils.tree_util import build_tree
 
 logger = logging.getLogger("log")
 
+menu_hierarchy = Hierarchy(Menu)
+dept_hierarchy = Hierarchy(Dept)
+dict_type_hierarchy = Hierarchy(DictType, parent_field="parent")
+dict_hierarchy = Hierarchy(Dict, parent_field="parent")
+
 
 class MenuBuildService:
     """
@@ -26,30 +44,33 @@ class MenuBuildService:
         Returns: 树型结构菜单
 
         """
-        roles = user.roles.all().distinct()
-        all_sql_menus = None
-        result = []
-        if not user.is_admin:
-            for role in roles:
-                temp_menus = (
-                    role.menus.filter(is_deleted=False, menu_type__in=[0, 1, 2])
-                        .distinct()
-                        .order_by("menu_sort")
-                )
-                # 合并queryset
-                if all_sql_menus is None:
-                    all_sql_menus = temp_menus
-                else:
-                    all_sql_menus = all_sql_menus | temp_menus
-        else:
+        role_ids = user.roles.values_list("role_id", flat=True).distinct()
+        return self.get_menus_by_roles(role_ids, user.is_admin)
+
+    def get_menus_by_roles(self, role_ids, is_admin=False):
+        """
+        根据角色返回菜单项，不包括按钮级别
+        Args:
+            role_ids: 角色ID集合
+            is_admin: 是否为admin帐号, admin返回全部菜单
+
+        Returns: 树型结构菜单
+
+        """
+        if is_admin:
             all_sql_menus = Menu.objects.filter(
                 is_deleted=False, menu_type__in=[0, 1, 2]
             ).order_by("menu_sort")
-
-        if all_sql_menus and len(all_sql_menus) > 0:
-            all_menus = self.handler_menus_data(all_sql_menus)
-            result = self.get_menus_child_all(all_menus)
-        return result
+        else:
+            all_sql_menus = (
+                Menu.objects.filter(
+                    role__in=list(role_ids), is_deleted=False, menu_type__in=[0, 1, 2]
+                )
+                .distinct()
+                .order_by("menu_sort")
+            )
+        all_menus = self.handler_menus_data(all_sql_menus)
+        return self.get_menus_child_all(all_menus)
 
     def get_all_menus(self, menu_name):
         """
@@ -75,67 +96,135 @@ class MenuBuildService:
         result = [MenuSerializer(menu).data for menu in menus]
         return result
 
-    def get_query_menus_child_all(self, menus):
+    @staticmethod
+    def get_query_menus_child_all(menus):
         """
-        根据查询后的结果,递归构建菜单
+        根据查询后的结果构建菜单, 每个查询结果都作为根节点
         Args:
             menus: 根据查询后的菜单结果
 
         Returns: 树型结构的菜单
 
         """
-        root_list = []
-        for menu in menus:
-            result = menu
-            root_list.append(result)
-        for root in root_list:
-            root_child = self.get_child(menus, root["menu_id"])
-            if root_child:
-                root["children"] = root_child
-        return root_list
+        return build_tree(menus, "menu_id", all_roots=True)
 
-    def get_menus_child_all(self, menus):
+    @staticmethod
+    def get_menus_child_all(menus):
         """
-        递归构建菜单，从root开始逐层向下构建
+        构建菜单，从root开始逐层向下构建
         Args:
             menus: 菜单集合
 
         Returns: 树型结构菜单
 
         """
+        return build_tree(menus, "menu_id")
+
+
+class MenuTreeCache:
+    """
+    按角色组合缓存已编码的侧边栏菜单树
+    缓存key由排序后的角色ID、各角色版本号与菜单树版本号组成, 菜单或角色变更时递增版本号,
+    事务提交后按用户当前的角色组合重新构建受影响的缓存, 超出MAX_REBUILD的组合在下次读取时构建
+    """
+
+    TIMEOUT = 60 * 60 * 24
+    # 每次变更最多主动构建的组合数
+    MAX_REBUILD = 50
+
+    def __init__(self, build_service):
+        self.build_service = build_service
+
+    @staticmethod
+    def get_combo(user):
+        if user.is_admin:
+            return "admin"
+        return tuple(sorted(set(user.roles.values_list("role_id", flat=True))))
+
+    @staticmethod
+    def get_key(combo):
+        names = [menu_hierarchy.version_name]
+        if combo != "admin":
+            names += [ROLE_VERSION.format(role_id) for role_id in combo]
+        versions = get_versions(names)
+        stamp = ",".join("{}={}".format(name, versions[name]) for name in names)
+        return "menu:build:" + hashlib.md5(stamp.encode()).hexdigest()
+
+    def build(self, combo):
+        if combo == "admin":
+            result = self.build_service.get_menus_by_roles([], is_admin=True)
+        else:
+            result = self.build_service.get_menus_by_roles(combo)
+        return encode_json(result)
+
+    def get(self, user):
+        """
+        Args:
+            user: 用户对象
 
-        root_list = []
-        for menu in menus:
-            if menu["pid"] is None:
-                result = menu
-                root_list.append(result)
-        for root in root_list:
-            root_child = self.get_child(menus, root["menu_id"])
-            if root_child:
-                root["children"] = root_child
+        Returns: RawJSON 已编码的树型结构菜单
+
+        """
+        combo = self.get_combo(user)
+        key = self.get_key(combo)
+        data = cache.get(key)
+        if data is None:
+            data = self.build(combo)
+            cache.set(key, bytes(data), self.TIMEOUT)
+        return RawJSON(data)
+
+    def affected_combos(self, role_ids=None):
+        """
+        从用户与角色的关联中取受影响的角色组合, 不另外登记已缓存的组合
+        Args:
+            role_ids: 变更的角色ID, 为None时(菜单变更)包含全部组合与管理员
 
-        return root_list
+        Returns: 角色组合列表
 
-    def get_child(self, menus, menu_id):
         """
-        获取菜单子节点
+        users = Users.objects.filter(is_deleted=False, is_admin=False)
+        if role_ids is not None:
+            users = users.filter(roles__in=list(role_ids))
+        roles = defaultdict(set)
+        for user_id, role_id in Users.roles.through.objects.filter(
+            users_id__in=users.values("id")
+        ).values_list("users_id", "role_id"):
+            roles[user_id].add(role_id)
+        combos = sorted({tuple(sorted(role_set)) for role_set in roles.values()})
+        if role_ids is None and Users.objects.filter(is_deleted=False, is_admin=True).exists():
+            combos.insert(0, "admin")
+        return combos[:self.MAX_REBUILD]
+
+    def rebuild(self, role_ids=None):
+        """
+        重新构建受影响的角色组合, 当前版本号下已构建的组合跳过
         Args:
-            menus: 菜单集合
-            menu_id: 菜单ID
+            role_ids: 变更的角色ID, 为None时(菜单变更)重新构建全部组合
 
-        Returns: 子节点树型结构
+        Returns: 构建的组合数
 
         """
-        child_list = []
-        for menu in menus:
-            if menu["pid"] == menu_id:
-                child_result = menu
-                child_list.append(child_result)
-            for child_menu in child_list:
-                child = self.get_child(menus, child_menu["menu_id"])
-                if child:
-                    child_menu["children"] = child
-        return child_list
+        built = 0
+        for combo in self.affected_combos(role_ids):
+            key = self.get_key(combo)
+            if cache.get(key) is None:
+                cache.set(key, bytes(self.build(combo)), self.TIMEOUT)
+                built += 1
+        return built
+
+    def schedule_rebuild(self, role_ids=None):
+        """
+        事务提交后重新构建, 失败时只记录日志, 由下次读取时构建
+        """
+        role_ids = None if role_ids is None else set(role_ids)
+
+        def rebuild():
+            try:
+                self.rebuild(role_ids)
+            except Exception:
+                logger.exception("menu tree rebuild failed")
+
+        transaction.on_commit(rebuild)
 
 
 class DeptBuildService:
@@ -159,73 +248,171 @@ class DeptBuildService:
 
     def get_query_dept_child_all(self, dept_list):
         """
-        根据查询后的结果递归构建部门
+        根据查询后的结果构建部门, 每个查询结果都作为根节点并挂载其全部子部门
+        子部门通过一次递归查询加载, 查询次数与树的深度无关
         Args:
             dept_list: 部门集合
 
         Returns: 树型结构部门
 
         """
-        root_list = []
-        for dept in dept_list:
-            result = dept
-            root_list.append(result)
-        for root in root_list:
-            root_child = self.get_query_child(root["dept_id"])
-            if root_child:
-                root["children"] = root_child
-        return root_list
+        dept_dict = {dept["dept_id"]: dept for dept in dept_list}
+        child_ids = dept_hierarchy.descendant_ids(list(dept_dict), cached=True)
+        children = Dept.objects.filter(dept_id__in=child_ids).exclude(
+            dept_id__in=list(dept_dict)
+        )
+        for dept in self.handler_dept_list_data(children):
+            dept_dict[dept["dept_id"]] = dept
+        build_tree(
+            list(dept_dict.values()), "dept_id", sort_key=lambda d: d["dept_sort"]
+        )
+        return dept_list
 
-    def get_dept_child_all(self, dept_list):
+    @staticmethod
+    def get_dept_child_all(dept_list):
         """
-        递归构建部门，从root开始逐层向下构建
+        构建部门，从root开始逐层向下构建
         Args:
             dept_list: 部门集合
 
         Returns: 树型结构部门
 
         """
-        root_list = []
-        for dept in dept_list:
-            if dept["pid"] is None:
-                result = dept
-                root_list.append(result)
-        for root in root_list:
-            root_child = self.get_child(dept_list, root["dept_id"])
-            if root_child:
-                root["children"] = root_child
-        return root_list
+        return build_tree(dept_list, "dept_id")
+
+
+class DictSnapshot:
+    """
+    按字典类型code分组的数据字典快照, 每组为已编码的JSON
+    快照以版本号为key缓存在redis与进程内缓存中, Dict、DictType变更后版本号加一
+    """
 
-    def get_child(self, dept_list, dept_id):
+    VERSION = "dict:snapshot"
+    KEY = "dict:snapshot:{}"
+    TIMEOUT = 60 * 60 * 24
+
+    @classmethod
+    def version(cls):
+        return get_version(cls.VERSION)
+
+    @classmethod
+    def etag(cls, version, codes):
         """
-        获取部门子节点
         Args:
-            dept_list: 部门集合
-            dept_id: 部门ID
-
-        Returns: 子节点树型结构
-
-        """
-        child_list = []
-        for dept in dept_list:
-            if dept["pid"] == dept_id:
-                child_result = dept
-                child_list.append(child_result)
-            for child_dept in child_list:
-                child = self.get_child(dept_list, child_dept["dept_id"])
-                if child:
-                    child_dept["children"] = child
-        return child_list
-
-    def get_query_child(self, dept_id):
-        child_list = []
-        children = Dept.objects.filter(is_deleted=False, pid=dept_id).order_by(
-            "dept_sort"
+            version: 快照版本号
+            codes: 请求的字典类型code, 为None时为全部
+
+        Returns: 带引号的ETag
+
+        """
+        stamp = "{}|{}".format(version, ",".join(sorted(codes)) if codes else "*")
+        return '"{}"'.format(hashlib.md5(stamp.encode()).hexdigest())
+
+    @staticmethod
+    def build():
+        """
+        Returns: {字典类型code: 已编码的字典列表}
+        """
+        queryset = (
+            Dict.objects.filter(is_deleted=False, dict_type__is_deleted=False)
+            .select_related("dict_type")
+            .order_by("-sort", "dict_id")
+        )
+        groups = {}
+        items = list(queryset)
+        for item, data in zip(items, DictSerializer(items, many=True).data):
+            groups.setdefault(item.dict_type.code, []).append(data)
+        return {code: bytes(encode_json(group)) for code, group in groups.items()}
+
+    def get(self, version):
+        """
+        Args:
+            version: 快照版本号
+
+        Returns: {字典类型code: 已编码的字典列表}
+
+        """
+        key = self.KEY.format(version)
+        snapshot = local_cache.get(key)
+        if snapshot is MISSING:
+            snapshot = cache.get(key)
+            if snapshot is None:
+                snapshot = self.build()
+                cache.set(key, snapshot, self.TIMEOUT)
+            # key中含版本号, 快照不会变化, 无需广播失效
+            local_cache.set(key, snapshot)
+        return snapshot
+
+    def render(self, version, codes=None):
+        """
+        Args:
+            version: 快照版本号
+            codes: 字典类型code, 为None时返回全部, 不存在的code返回空列表
+
+        Returns: RawJSON {code: [字典]}
+
+        """
+        snapshot = self.get(version)
+        if codes is None:
+            codes = sorted(snapshot)
+        parts = [
+            encode_json(code) + b":" + snapshot.get(code, b"[]") for code in codes
+        ]
+        return RawJSON(b"{" + b",".join(parts) + b"}")
+
+    def invalidate(self):
+        """
+        立即使快照失效, 事务提交后再失效一次, 避免提交前重建的快照使用新版本号
+        """
+        bump_version(self.VERSION)
+        transaction.on_commit(lambda: bump_version(self.VERSION))
+
+
+def backfill_dict_fullname(start_id=None, chunk_size=10000, max_chunks=None, progress=None):
+    """
+    按主键区间分批重新计算Dict.fullname, 规则与Dict.save一致: code不为空且不包含在dict_name中时为 code-dict_name
+    每批一条UPDATE, 已正确的行不更新, 可从任意主键重新开始
+    Args:
+        start_id: 起始主键, 为None时从最小主键开始
+        chunk_size: 每批的主键区间长度
+        max_chunks: 最多执行的批数, 为None时执行到结束
+        progress: 每批完成后的回调, progress(起始主键, 结束主键(不含), 更新行数)
+
+    Returns: {"updated": 更新行数, "next_id": 下次的起始主键, 结束时为None}
+
+    """
+    bounds = Dict.objects.aggregate(min_id=Min("dict_id"), max_id=Max("dict_id"))
+    if bounds["max_id"] is None:
+        # 空表
+        return {"updated": 0, "next_id": None}
+    start = bounds["min_id"] if start_id is None else max(start_id, bounds["min_id"])
+    fullname = Concat(F("code"), Value("-"), F("dict_name"), output_field=CharField())
+    updated = 0
+    chunks = 0
+    while start <= bounds["max_id"]:
+        if max_chunks is not None and chunks >= max_chunks:
+            break
+        end = start + chunk_size
+        count = (
+            Dict.objects.filter(dict_id__gte=start, dict_id__lt=end)
+            .exclude(code__isnull=True)
+            .exclude(code="")
+            .annotate(code_position=StrIndex("dict_name", "code"))
+            .filter(code_position=0)
+            .exclude(fullname=fullname)
+            .update(fullname=fullname)
         )
-        if children:
-            child_list = [DeptSerializer(child).data for child in children]
-            for child_dept in child_list:
-                child = self.get_query_child(child_dept["dept_id"])
-                if child:
-                    child_dept["children"] = child
-        return child_list
+        updated += count
+        chunks += 1
+        if progress is not None:
+            progress(start, end, count)
+        start = end
+    if updated:
+        # update不触发post_save, 单独使字典快照失效
+        dict_snapshot.invalidate()
+    return {"updated": updated, "next_id": None if start > bounds["max_id"] else start}
+
+
+menu_build_service = MenuBuildService()
+menu_tree_cache = MenuTreeCache(menu_build_service)
+dict_snapshot = DictSnapshot()
@@ -0,0 +1,206 @@
+# author:hao.lu
+# create_date: 10/13/2020 9:40 AM
+# file : session_store.py
+# IDE: PyCharm
+
+# ! -*- coding: utf-8 -*-
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from utils.cache_version import version_key
+from utils.local_cache import MISSING, invalidation_bus, local_cache
+
+SESSION_KEY = "session:{}"
+# 会话记录字段: token指纹(jti), 用户ID, 权限, 权限版本号
+SESSION_FIELDS = ("jti", "user_id", "perms", "ver")
+
+
+def _encode_perms(perms):
+    return "\n".join(sorted(perms))
+
+
+def _decode_perms(value):
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode()
+    return frozenset(value.split("\n")) if value else frozenset()
+
+
+class CacheSessionStore:
+    """
+    通用缓存实现, 会话记录整体存为一个dict
+    """
+
+    def load(self, user_id, version_name):
+        """
+        一次缓存往返读取会话记录与版本号
+        Args:
+            user_id: 用户ID
+            version_name: 权限版本号名称
+
+        Returns: (record, version), record不存在时为None
+
+        """
+        key = SESSION_KEY.format(user_id)
+        ver_key = version_key(version_name)
+        found = cache.get_many([key, ver_key])
+        record = found.get(key)
+        if record is not None:
+            record = dict(record, perms=_decode_perms(record.get("perms")))
+        return record, found.get(ver_key)
+
+    def open(self, user_id, jti, perms, version, timeout):
+        record = {
+            "jti": jti,
+            "user_id": user_id,
+            "perms": _encode_perms(perms),
+            "ver": version,
+            "exp": time.time() + timeout,
+        }
+        cache.set(SESSION_KEY.format(user_id), record, timeout)
+
+    @staticmethod
+    def _update(key, record, **fields):
+        # 保持会话原有的过期时间
+        record.update(fields)
+        timeout = record["exp"] - time.time()
+        if timeout > 0:
+            cache.set(key, record, timeout)
+
+    def set_perms(self, user_id, perms, version):
+        key = SESSION_KEY.format(user_id)
+        record = cache.get(key)
+        if record is not None:
+            self._update(key, record, perms=_encode_perms(perms), ver=version)
+
+    def drop_perms(self, user_ids):
+        keys = [SESSION_KEY.format(user_id) for user_id in user_ids]
+        for key, record in cache.get_many(keys).items():
+            self._update(key, record, perms=None, ver=None)
+
+    def close(self, user_id):
+        cache.delete(SESSION_KEY.format(user_id))
+
+    def flush_local(self):
+        pass
+
+
+class RedisSessionStore:
+    """
+    django_redis实现, 会话记录存为一个hash, 与版本号在同一pipeline中读取
+    """
+
+    def __init__(self, alias="default"):
+        self.alias = alias
+
+    @property
+    def client(self):
+        from django_redis import get_redis_connection
+
+        return get_redis_connection(self.alias)
+
+    def load(self, user_id, version_name):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hmget(cache.make_key(SESSION_KEY.format(user_id)), SESSION_FIELDS)
+        pipe.get(cache.make_key(version_key(version_name)))
+        values, version = pipe.execute()
+        version = int(version) if version is not None else None
+        jti, record_user_id, perms, ver = values
+        if record_user_id is None:
+            return None, version
+        record = {
+            "jti": jti.decode() if jti is not None else None,
+            "user_id": int(record_user_id),
+            "perms": _decode_perms(perms),
+            "ver": int(ver) if ver else None,
+        }
+        return record, version
+
+    def open(self, user_id, jti, perms, version, timeout):
+        key = cache.make_key(SESSION_KEY.format(user_id))
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        pipe.hset(
+            key,
+            mapping={
+                "jti": jti,
+                "user_id": user_id,
+                "perms": _encode_perms(perms),
+                "ver": version,
+            },
+        )
+        pipe.expire(key, int(timeout))
+        pipe.execute()
+
+    def set_perms(self, user_id, perms, version):
+        key = cache.make_key(SESSION_KEY.format(user_id))
+        # 会话已过期时不再写入, 避免留下无过期时间的hash
+        if self.client.exists(key):
+            self.client.hset(key, mapping={"perms": _encode_perms(perms), "ver": version})
+
+    def drop_perms(self, user_ids):
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.hdel(cache.make_key(SESSION_KEY.format(user_id)), "perms", "ver")
+        pipe.execute()
+
+    def close(self, user_id):
+        self.client.delete(cache.make_key(SESSION_KEY.format(user_id)))
+
+    def flush_local(self):
+        pass
+
+
+class LocalCachedSessionStore:
+    """
+    在会话存储前增加进程内缓存, 会话变更通过invalidation_bus通知其他worker
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def load(self, user_id, version_name):
+        invalidation_bus.ensure_listener()
+        key = SESSION_KEY.format(user_id)
+        found = local_cache.get(key)
+        if found is MISSING:
+            found = self.store.load(user_id, version_name)
+            # 只缓存存在的会话, 登录后无需等待其他worker失效
+            if found[0] is not None:
+                local_cache.set(key, found)
+        return found
+
+    def open(self, user_id, jti, perms, version, timeout):
+        self.store.open(user_id, jti, perms, version, timeout)
+        invalidation_bus.publish([SESSION_KEY.format(user_id)])
+
+    def set_perms(self, user_id, perms, version):
+        self.store.set_perms(user_id, perms, version)
+        local_cache.delete(SESSION_KEY.format(user_id))
+
+    def drop_perms(self, user_ids):
+        self.store.drop_perms(user_ids)
+        invalidation_bus.publish([SESSION_KEY.format(user_id) for user_id in user_ids])
+
+    def close(self, user_id):
+        self.store.close(user_id)
+        invalidation_bus.publish([SESSION_KEY.format(user_id)])
+
+    def flush_local(self):
+        invalidation_bus.publish("*")
+
+
+def get_session_store():
+    if "django_redis" in settings.CACHES["default"]["BACKEND"]:
+        store = RedisSessionStore()
+    else:
+        store = CacheSessionStore()
+    if local_cache.ttl > 0:
+        store = LocalCachedSessionStore(store)
+    return store
+
+
+session_store = get_session_store()
@@ -0,0 +1,106 @@
+# author:hao.lu
+# create_date: 10/12/2020 11:02 AM
+# file : signals.py
+# IDE: PyCharm
+
+# ! -*- coding: utf-8 -*-
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import perm_cache
+from .authentication import forget_missing
+from .models import Dept, Dict, DictType, Menu, Role, Users
+from .service import (
+    dept_hierarchy,
+    dict_hierarchy,
+    dict_snapshot,
+    dict_type_hierarchy,
+    menu_hierarchy,
+    menu_tree_cache,
+)
+
+
+@receiver(post_save, sender=Menu)
+@receiver(post_delete, sender=Menu)
+def menu_changed(sender, instance, **kwargs):
+    perm_cache.invalidate_all()
+    menu_hierarchy.bump()
+    menu_tree_cache.schedule_rebuild()
+
+
+@receiver(post_save, sender=Dept)
+@receiver(post_delete, sender=Dept)
+def dept_changed(sender, instance, **kwargs):
+    dept_hierarchy.bump()
+
+
+@receiver(post_save, sender=DictType)
+@receiver(post_delete, sender=DictType)
+def dict_type_changed(sender, instance, **kwargs):
+    dict_type_hierarchy.bump()
+    dict_snapshot.invalidate()
+
+
+@receiver(post_save, sender=Dict)
+@receiver(post_delete, sender=Dict)
+def dict_changed(sender, instance, **kwargs):
+    dict_hierarchy.bump()
+    dict_snapshot.invalidate()
+
+
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+def role_changed(sender, instance, **kwargs):
+    perm_cache.invalidate_role(instance.pk)
+    menu_tree_cache.schedule_rebuild([instance.pk])
+
+
+@receiver(m2m_changed, sender=Role.menus.through)
+def role_menus_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if reverse:
+        # menu.role_set 变更, instance 为菜单
+        role_ids = pk_set or []
+        for role_id in role_ids:
+            perm_cache.invalidate_role(role_id)
+        if action == "post_clear":
+            perm_cache.invalidate_all()
+            # 不知道受影响的角色, 使全部菜单树缓存失效
+            menu_hierarchy.bump()
+            menu_tree_cache.schedule_rebuild()
+        elif role_ids:
+            menu_tree_cache.schedule_rebuild(role_ids)
+    else:
+        perm_cache.invalidate_role(instance.pk)
+        menu_tree_cache.schedule_rebuild([instance.pk])
+
+
+@receiver(m2m_changed, sender=Users.roles.through)
+def user_roles_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if reverse:
+        # role.users_set 变更, instance 为角色
+        if action == "post_clear":
+            perm_cache.invalidate_role(instance.pk)
+        else:
+            perm_cache.invalidate_users(pk_set or [])
+    else:
+        perm_cache.invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=Users)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) == {"last_login"}:
+        return
+    if not created:
+        # is_admin 可能变更
+        perm_cache.invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=Users)
+def user_identifiers_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {"last_login", "password"}:
+        return
+    forget_missing(instance)
@@ -1,7 +1,53 @@
+import asyncio
+import base64
 import datetime
-from django.test import TestCase
+import decimal
+import json
+import os
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from io import StringIO
+from unittest import mock
+
+from Crypto.Cipher import PKCS1_v1_5
+from Crypto.PublicKey import RSA
+from django.contrib.auth.hashers import check_password
+from django.core.cache import cache
+from django.db import connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ErrorDetail, ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
 from rest_framework.test import APIClient
-from apps.system.models import Users, Dept, Position, Role, Menu
+from rest_framework_simplejwt.tokens import AccessToken
+from apps.system.models import Users, Dept, Dict, DictType, Position, Role, Menu
+from apps.system.authentication import lookup_user
+from apps.system.login_limiter import LocalSlidingWindow, LoginLimiter, LoginLocked
+from apps.system.menu_build_service import MenuBuildSevice
+from apps.system.service import (
+    DeptBuildService,
+    backfill_dict_fullname,
+    MenuBuildService,
+    menu_hierarchy,
+    menu_tree_cache,
+)
+from apps.system.serializers import PositionSerializer, UserCreateSerializer, UserModifySerializer
+from utils.baseResponse import FitJSONRenderer, encode_json
+from utils.constant import DEFAULT_PASSWORD, JSON_ACCOUNT_VALIDATION_ERROR
+from utils.credential_pool import CredentialPool, CredentialPoolBusy
+from utils.crypto_util import RSAKeyManager
+from utils.local_cache import local_cache
+from utils.message_catalog import get_language
+from utils.pagination import count_queryset
+from utils.querySetUtil import get_child_queryset2
+from utils.tree_util import build_tree
+from apps.system.perm_cache import get_user_permissions, open_session, close_session
 # get_now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
 
@@ -214,12 +260,22 @@ class SystemModuleTest(TestCase):
         self.api_client = APIClient()
 
     def setUp(self) -> None:
+        cache.clear()
+        local_cache.clear()
         self.init_dept()
         self.init_position()
         self.init_Role()
         self.init_User()
         self.init_menu()
 
+    def login(self, user):
+        """
+        签发token并写入会话, 之后的请求以该用户认证
+        """
+        token = AccessToken.for_user(user)
+        open_session(user, token["jti"], 60)
+        self.api_client.credentials(HTTP_AUTHORIZATION="Bearer {0}".format(token))
+
     def test_users_model(self):
         query_set = Users.objects.filter(user_name="admin").first()
         self.assertEqual(query_set.id, 1)
@@ -242,3 +298,708 @@ class SystemModuleTest(TestCase):
         self.api_client.credentials(HTTP_AUTHORIZATION="{0}".format(self.token))
         response = self.api_client.get("/system/user/", content_type="application/json")
         self.assertEqual(response.status_code, 200)
+
+    def test_permission_cache_invalidation(self):
+        user = Users.objects.get(id=1)
+        role = Role.objects.get(role_id=1)
+        self.assertEqual(get_user_permissions(user), frozenset())
+        user.roles.add(role)
+        role.menus.add(Menu.objects.get(menu_id=3))
+        self.assertEqual(get_user_permissions(user), frozenset(["role_list"]))
+        Menu.objects.filter(menu_id=3).update(permission="role_view")
+        Menu.objects.get(menu_id=3).save()
+        self.assertEqual(get_user_permissions(user), frozenset(["role_view"]))
+        role.menus.clear()
+        self.assertEqual(get_user_permissions(user), frozenset())
+
+    def test_session_record(self):
+        user = Users.objects.get(id=2)
+        token = AccessToken.for_user(user)
+        self.api_client.credentials(HTTP_AUTHORIZATION="Bearer {0}".format(token))
+        response = self.api_client.get("/system/position/")
+        self.assertEqual(response.status_code, 403)
+        open_session(user, token["jti"], 60)
+        response = self.api_client.get("/system/position/")
+        self.assertEqual(response.status_code, 200)
+        hits = local_cache.hits
+        response = self.api_client.get("/system/cache/stats/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(local_cache.hits, hits + 1)
+        # 重新登录后旧token失效
+        open_session(user, AccessToken.for_user(user)["jti"], 60)
+        response = self.api_client.get("/system/position/")
+        self.assertEqual(response.status_code, 403)
+        open_session(user, token["jti"], 60)
+        close_session(user.id)
+        response = self.api_client.get("/system/position/")
+        self.assertEqual(response.status_code, 403)
+
+    def test_monitor_view_perm(self):
+        user = Users.objects.get(id=1)
+        role = Role.objects.get(role_id=1)
+        user.roles.add(role)
+        role.menus.add(Menu.objects.get(menu_id=3))
+        self.login(user)
+        response = self.api_client.get("/system/cache/stats/")
+        self.assertEqual(response.status_code, 403)
+        Menu.objects.filter(menu_id=3).update(permission="monitor_view")
+        Menu.objects.get(menu_id=3).save()
+        response = self.api_client.get("/system/cache/stats/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_menu_tree(self):
+        result = MenuBuildService().get_all_menus(None)
+        self.assertEqual([menu["menu_id"] for menu in result], [1])
+        system = result[0]["children"][0]
+        self.assertEqual(
+            [menu["menu_id"] for menu in system["children"]], [3, 4, 6, 7, 5]
+        )
+        self.assertEqual(len(system["children"][-1]["children"]), 3)
+
+    def test_dept_query_tree(self):
+        Dept.objects.create(
+            dept_id=7, dept_name="测试组", pid=6, dept_sort=1, is_activate=True
+        )
+        with self.assertNumQueries(3):
+            result = DeptBuildService().get_dept_all("分部")
+        self.assertEqual([dept["dept_id"] for dept in result], [2, 3, 4])
+        dev = result[2]["children"][0]
+        self.assertEqual(dev["dept_id"], 6)
+        self.assertEqual([dept["dept_id"] for dept in dev["children"]], [7])
+
+    def test_dept_path(self):
+        Dept.objects.create(
+            dept_id=7, dept_name="测试组", pid=6, dept_sort=1, is_activate=True
+        )
+        self.assertEqual(Dept.objects.get(dept_id=7).path, "/1/4/6/7/")
+        root = Dept.objects.get(dept_id=1)
+        self.assertEqual(
+            set(get_child_queryset2(root).values_list("dept_id", flat=True)),
+            {1, 2, 3, 4, 6, 7},
+        )
+        dev = Dept.objects.get(dept_id=6)
+        dev.pid = 2
+        dev.save()
+        self.assertEqual(Dept.objects.get(dept_id=7).path, "/1/2/6/7/")
+        Dept.objects.get(dept_id=2).delete(soft=True)
+        self.assertEqual(
+            set(get_child_queryset2(root).values_list("dept_id", flat=True)),
+            {1, 3, 4},
+        )
+        with self.assertRaises(ValueError):
+            root.pid = 7
+            root.save()
+
+    def test_dept_path_validation(self):
+        self.login(Users.objects.get(id=2))
+        response = self.api_client.patch("/system/dept/4/", {"pid": 6}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Dept.objects.get(dept_id=4).pid, 1)
+        # 初始化sql导入的部门没有路径, 子集按上级关系查询而不是匹配全部部门
+        Dept.objects.filter(dept_id__in=[4, 6]).update(path=None)
+        dept = Dept.objects.get(dept_id=4)
+        self.assertEqual(
+            set(get_child_queryset2(dept).values_list("dept_id", flat=True)), {4, 6}
+        )
+        Dept.objects.create(
+            dept_id=7, dept_name="测试组", pid=6, dept_sort=1, is_activate=True
+        )
+        self.assertIsNone(Dept.objects.get(dept_id=7).path)
+        self.assertEqual(
+            set(get_child_queryset2(dept, False).values_list("dept_id", flat=True)),
+            {6, 7},
+        )
+
+    def test_dept_move_under_pathless_parent(self):
+        Dept.objects.create(dept_id=8, dept_name="测试组", pid=2, dept_sort=1)
+        Dept.objects.filter(dept_id__in=[4, 6]).update(path=None)
+        dept = Dept.objects.get(dept_id=2)
+        dept.pid = 6
+        dept.save()
+        # 子树路径置为NULL, 不拼接出相对路径
+        self.assertEqual(
+            list(Dept.objects.filter(dept_id__in=[2, 8]).values_list("path", flat=True)),
+            [None, None],
+        )
+        subset = get_child_queryset2(Dept.objects.get(dept_id=4))
+        self.assertEqual(set(subset.values_list("dept_id", flat=True)), {2, 4, 6, 8})
+        # 没有路径时沿上级关系检查成环
+        self.login(Users.objects.get(id=2))
+        response = self.api_client.patch("/system/dept/2/", {"pid": 8}, format="json")
+        self.assertEqual(response.status_code, 400)
+        with self.assertRaises(ValueError):
+            dept = Dept.objects.get(dept_id=4)
+            dept.pid = 8
+            dept.save()
+        # 移回有路径的上级部门时按上级关系重建子树路径
+        dept = Dept.objects.get(dept_id=2)
+        dept.pid = 1
+        dept.save()
+        self.assertEqual(Dept.objects.get(dept_id=8).path, "/1/2/8/")
+
+    def test_menu_hierarchy(self):
+        self.assertEqual(sorted(menu_hierarchy.descendant_ids([5])), [8, 9, 10])
+        self.assertEqual(menu_hierarchy.ancestor_ids(8), [5, 2, 1])
+        self.assertEqual(menu_hierarchy.depth(1), 0)
+        self.assertEqual(menu_hierarchy.depth(9), 3)
+        with self.assertNumQueries(1):
+            menu_hierarchy.descendant_ids([2], cached=True)
+        with self.assertNumQueries(0):
+            menu_hierarchy.descendant_ids([2], cached=True)
+        Menu.objects.filter(menu_id=10).update(pid=3)
+        Menu.objects.get(menu_id=10).save()
+        self.assertEqual(
+            sorted(menu_hierarchy.descendant_ids([3], cached=True)), [10]
+        )
+
+    def test_menu_build_cache(self):
+        self.login(Users.objects.get(id=2))
+        role = Role.objects.get(role_id=1)
+        role.menus.add(*Menu.objects.filter(menu_id__in=[1, 2, 3]))
+        Users.objects.get(id=1).roles.add(role)
+        response = self.api_client.get("/system/menu/build/?user_id=1")
+        body = json.loads(response.content)
+        self.assertEqual(body["code"], 200)
+        self.assertEqual(body["data"][0]["children"][0]["children"][0]["menu_id"], 3)
+        # 认证用户、目标用户、角色ID, 菜单树来自缓存
+        with self.assertNumQueries(3):
+            cached = self.api_client.get("/system/menu/build/?user_id=1")
+        self.assertEqual(cached.content, response.content)
+        # 角色变更在事务提交后重新构建受影响的组合, 读取时不再构建
+        with mock.patch("apps.system.service.transaction.on_commit", lambda func: func()):
+            role.menus.add(Menu.objects.get(menu_id=4))
+        with self.assertNumQueries(3):
+            response = self.api_client.get("/system/menu/build/?user_id=1")
+        menus = json.loads(response.content)["data"][0]["children"][0]["children"]
+        self.assertEqual([menu["menu_id"] for menu in menus], [3, 4])
+        self.assertEqual(menu_tree_cache.affected_combos([1]), [(1,)])
+        self.assertEqual(menu_tree_cache.affected_combos([2]), [])
+        self.assertEqual(menu_tree_cache.affected_combos(), ["admin", (1,)])
+        # 当前版本号下已构建的组合跳过
+        self.assertEqual(menu_tree_cache.rebuild(), 1)
+
+    def test_menu_sidebar_build(self):
+        user = Users.objects.get(id=1)
+        role = Role.objects.get(role_id=1)
+        role.menus.add(*Menu.objects.filter(menu_id__in=[3, 4, 8]))
+        user.roles.add(role)
+        with self.assertNumQueries(3):
+            result = MenuBuildSevice().build(user)
+        self.assertEqual(result[0]["menu_id"], 1)
+        menus = result[0]["children"][0]["children"]
+        self.assertEqual([menu["menu_id"] for menu in menus], [3, 4])
+        # pid成环的菜单不会导致无限递归, 也不会出现在侧边栏中
+        Menu.objects.filter(menu_id=5).update(pid=10)
+        Menu.objects.filter(menu_id=10).update(menu_type=2)
+        role.menus.add(*Menu.objects.filter(menu_id__in=[7, 10]))
+        self.assertEqual(menu_hierarchy.ancestor_ids_many([10]), {5, 10})
+        result = MenuBuildSevice().build(user)
+        menus = result[0]["children"][0]["children"]
+        self.assertEqual([menu["menu_id"] for menu in menus], [3, 4, 7])
+
+    def test_reset_password(self):
+        self.login(Users.objects.get(id=2))
+        response = self.api_client.put("/system/user/1/reset_password/")
+        self.assertEqual(response.status_code, 200)
+        password = Users.objects.get(id=1).password
+        self.assertTrue(check_password(DEFAULT_PASSWORD, password))
+
+    def test_lookup_user(self):
+        user = Users.objects.get(id=1)
+        Users.objects.filter(id=1).update(phone="13800000000", email="a@b.com")
+        with self.assertNumQueries(1):
+            self.assertEqual(lookup_user("13800000000"), user)
+        self.assertEqual(lookup_user("a@b.com"), user)
+        self.assertEqual(lookup_user(user.user_name), user)
+        self.assertIsNone(lookup_user("13900000000"))
+        # 不存在的登录标识不再查询数据库
+        with self.assertNumQueries(0):
+            self.assertIsNone(lookup_user("13900000000"))
+        user.phone = "13900000000"
+        user.save()
+        self.assertEqual(lookup_user("13900000000"), user)
+
+    def test_login_limiter(self):
+        data = {"user_name": "nobody", "password": "x"}
+        for _ in range(5):
+            response = self.client.post(
+                "/system/login/", data=data, content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 401)
+        # 超过限制后在查询用户与解密之前拒绝
+        with self.assertNumQueries(0):
+            response = self.client.post(
+                "/system/login/", data=data, content_type="application/json"
+            )
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+
+    def test_login_undecryptable_password(self):
+        data = {"user_name": "admin", "password": "abc"}
+        for _ in range(5):
+            response = self.client.post(
+                "/system/login/", data=data, content_type="application/json"
+            )
+            # 无法解密的密码按密码错误处理并计入失败次数
+            self.assertEqual(response.status_code, 401)
+        response = self.client.post(
+            "/system/login/", data=data, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 429)
+
+    def test_user_cursor_pagination(self):
+        self.login(Users.objects.get(id=2))
+        for user_id in range(3, 6):
+            Users.objects.create(id=user_id, user_name="user{}".format(user_id))
+        response = self.api_client.get("/system/user/?pagination=cursor&page_size=2")
+        body = json.loads(response.content)
+        self.assertEqual(body["code"], 200)
+        self.assertEqual([user["id"] for user in body["data"]["results"]], [5, 4])
+        self.assertIsNone(body["data"]["previous"])
+        # 下一页按id定位, 不执行COUNT与OFFSET
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.api_client.get(body["data"]["next"])
+        sql = " ".join(query["sql"] for query in ctx.captured_queries)
+        self.assertNotIn("COUNT(", sql)
+        self.assertNotIn("OFFSET", sql)
+        body = json.loads(response.content)
+        self.assertEqual([user["id"] for user in body["data"]["results"]], [3, 2])
+        response = self.api_client.get(body["data"]["next"])
+        body = json.loads(response.content)
+        self.assertEqual([user["id"] for user in body["data"]["results"]], [1])
+        self.assertIsNone(body["data"]["next"])
+
+    def test_user_list_queries(self):
+        self.login(Users.objects.get(id=2))
+        role = Role.objects.get(role_id=1)
+        for user_id in range(3, 101):
+            user = Users.objects.create(
+                id=user_id, user_name="user{}".format(user_id), dept_id=2, position_id=1
+            )
+            user.roles.add(role)
+        # 认证、COUNT、用户(含部门与岗位)、角色
+        with self.assertNumQueries(4):
+            response = self.api_client.get("/system/user/?page=1&page_size=100")
+        results = json.loads(response.content)["data"]["results"]
+        self.assertEqual(len(results), 100)
+        self.assertEqual(results[0]["roles_name"], ["管理员"])
+        self.assertEqual(results[0]["position_name"], "SE")
+        with self.assertNumQueries(3):
+            self.api_client.get("/system/user/?pagination=cursor&page_size=100")
+
+    def test_pagination_count(self):
+        self.login(Users.objects.get(id=2))
+        response = self.api_client.get("/system/user/?page=1&page_size=1")
+        data = json.loads(response.content)["data"]
+        self.assertEqual((data["count"], data["count_exact"]), (2, True))
+        queryset = Users.objects.filter(is_deleted=False)
+        with self.settings(PAGINATION_COUNT={"EXACT_THRESHOLD": 2, "TIMEOUT": 60}):
+            self.assertEqual(count_queryset(queryset), (2, True))
+            Users.objects.create(id=3, user_name="user3")
+            # 大表的COUNT结果按查询缓存
+            with self.assertNumQueries(0):
+                self.assertEqual(count_queryset(queryset), (2, False))
+            self.assertEqual(count_queryset(queryset.filter(id__gt=1)), (2, True))
+        self.assertEqual(count_queryset(Users.objects.none()), (0, True))
+
+    def test_pagination_stale_count(self):
+        self.login(Users.objects.get(id=2))
+        for user_id in range(3, 8):
+            Users.objects.create(id=user_id, user_name="user%s" % user_id)
+        url = "/system/user/?page={}&page_size=2"
+        with self.settings(PAGINATION_COUNT={"EXACT_THRESHOLD": 5, "TIMEOUT": 60}):
+            data = json.loads(self.api_client.get(url.format(1)).content)["data"]
+            self.assertEqual((data["count"], data["count_exact"]), (7, True))
+            for user_id in range(8, 15):
+                Users.objects.create(id=user_id, user_name="user%s" % user_id)
+            # 缓存的总数为7, 超出旧总数的页仍然返回数据
+            response = self.api_client.get(url.format(6))
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.content)["data"]
+            self.assertEqual((data["count"], data["count_exact"]), (7, False))
+            self.assertEqual(len(data["results"]), 2)
+            self.assertIsNotNone(data["next"])
+            data = json.loads(self.api_client.get(url.format(7)).content)["data"]
+            self.assertEqual(len(data["results"]), 2)
+            self.assertIsNone(data["next"])
+            # 确实没有数据的页才是空页
+            self.assertEqual(self.api_client.get(url.format(8)).status_code, 400)
+
+    def test_user_export(self):
+        Users.objects.create(id=3, user_name="user3", dept_id=2)
+        user = Users.objects.get(id=1)
+        role = Role.objects.get(role_id=1)
+        role.depts.add(Dept.objects.get(dept_id=2))
+        role.menus.add(
+            Menu.objects.create(menu_id=11, pid=5, menu_type=3, menu_name="用户导出", permission="user_export")
+        )
+        user.roles.add(role)
+        self.login(user)
+        response = self.api_client.get("/system/user/export/")
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode("utf-8-sig").splitlines()
+        self.assertTrue(lines[0].startswith("id,user_name"))
+        # 自定义数据权限: 角色关联部门的用户与本人
+        self.assertEqual([line.split(",")[1] for line in lines[1:]], ["user3", "admin"])
+        response = self.api_client.get("/system/user/export/?file_type=ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([row["dept"] for row in rows], ["华南分部", "开发部"])
+        response = self.api_client.get("/system/dict/export/")
+        self.assertEqual(response.status_code, 403)
+
+    def test_unique_validation(self):
+        data = {
+            "user_name": "admin",
+            "nick_name": "重复",
+            "phone": "18888888888",
+            "email": "new@test.com",
+            "dept": 2,
+            "position": 1,
+            "roles": [1],
+        }
+        serializer = UserCreateSerializer(data=data)
+        # 唯一字段一次查询, 其余为部门、岗位、角色的主键校验
+        with self.assertNumQueries(4):
+            self.assertFalse(serializer.is_valid())
+        self.assertEqual(sorted(serializer.errors), ["phone", "user_name"])
+        self.assertEqual(serializer.errors["user_name"], JSON_ACCOUNT_VALIDATION_ERROR)
+        # 修改时排除自身
+        user = Users.objects.get(id=1)
+        serializer = UserModifySerializer(
+            user, data={"user_name": "admin", "phone": "18888888888"}, partial=True
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer = PositionSerializer(
+            data=[{"position_name": "PM"}, {"position_name": "SE"}, {"position_name": "PM"}],
+            many=True,
+        )
+        with self.assertNumQueries(1):
+            self.assertFalse(serializer.is_valid())
+        self.assertEqual(
+            [list(errors) for errors in serializer.errors], [[], ["position_name"], ["position_name"]]
+        )
+        # 校验后写入前的并发写入由数据库约束转换为同样的错误
+        serializer = PositionSerializer(data={"position_name": "PM"})
+        self.assertTrue(serializer.is_valid())
+        Position.objects.create(position_id=2, position_name="PM")
+        with self.assertRaises(ValidationError) as ctx:
+            serializer.save()
+        self.assertEqual(list(ctx.exception.detail), ["position_name"])
+
+    def test_dict_batch(self):
+        self.login(Users.objects.get(id=2))
+        gender = DictType.objects.create(dict_type_name="性别", code="gender")
+        state = DictType.objects.create(dict_type_name="状态", code="status")
+        Dict.objects.create(dict_name="男", code="1", dict_type=gender, sort=2)
+        female = Dict.objects.create(dict_name="女", code="2", dict_type=gender, sort=1)
+        Dict.objects.create(dict_name="启用", code="1", dict_type=state)
+        response = self.api_client.get("/system/dict/batch/?codes=gender,missing")
+        data = json.loads(response.content)["data"]
+        self.assertEqual([item["dict_name"] for item in data["gender"]], ["男", "女"])
+        self.assertEqual(data["missing"], [])
+        etag = response["ETag"]
+        # 未变化时只有认证查询, 不读取字典表
+        with self.assertNumQueries(1):
+            response = self.api_client.get(
+                "/system/dict/batch/?codes=missing,gender", HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        female.dict_name = "女性"
+        female.save()
+        response = self.api_client.get(
+            "/system/dict/batch/?codes=gender,missing", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        data = json.loads(response.content)["data"]
+        self.assertEqual([item["dict_name"] for item in data["gender"]], ["男", "女性"])
+        response = self.api_client.get("/system/dict/batch/")
+        self.assertEqual(list(json.loads(response.content)["data"]), ["gender", "status"])
+
+    def test_dict_fullname_backfill(self):
+        dict_type = DictType.objects.create(dict_type_name="尺码", code="size")
+        for dict_name, code in [("男", "M"), ("M码", "M"), ("abc", "A"), ("无编号", None)]:
+            Dict.objects.create(dict_name=dict_name, code=code, dict_type=dict_type)
+        Dict.objects.update(fullname=None)
+        self.api_client.credentials()
+        response = self.api_client.post("/system/dict/correct/")
+        self.assertEqual(response.status_code, 401)
+        self.login(Users.objects.get(id=2))
+        etag = self.api_client.get("/system/dict/batch/")["ETag"]
+        first_id = Dict.objects.order_by("dict_id").first().dict_id
+        response = self.api_client.post(
+            "/system/dict/correct/", data={"chunk_size": 1, "max_chunks": 2}, format="json"
+        )
+        result = json.loads(response.content)["data"]
+        self.assertEqual(result, {"updated": 1, "next_id": first_id + 2})
+        # 批量更新后字典快照失效
+        self.assertNotEqual(self.api_client.get("/system/dict/batch/")["ETag"], etag)
+        out = StringIO()
+        call_command(
+            "backfill_dict_fullname", "--start-id", str(result["next_id"]), "--chunk-size", "1", stdout=out
+        )
+        self.assertIn("updated 1 dicts", out.getvalue())
+        self.assertEqual(
+            list(Dict.objects.order_by("dict_id").values_list("fullname", flat=True)),
+            ["M-男", None, "A-abc", None],
+        )
+        Dict.objects.all().delete()
+        self.assertEqual(backfill_dict_fullname(start_id=first_id), {"updated": 0, "next_id": None})
+
+    def test_user_import(self):
+        self.login(Users.objects.get(id=2))
+        upload = SimpleUploadedFile(
+            "users.csv",
+            "user_name,nick_name,phone,email,dept,position,roles\n"
+            "user3,用户3,13000000003,user3@test.com,2,1,1\n"
+            "user4,用户4,13000000004,,6,,\n"
+            "admin,重复,13000000005,,,,\n".encode("utf-8-sig"),
+        )
+        lookup_user("user3")
+        # 查询数与行数无关: 认证、3个唯一字段、3个关联字段、插入用户、取回主键、插入角色关联
+        with self.assertNumQueries(12):
+            response = self.api_client.post("/system/user/import/", {"file": upload})
+        result = json.loads(response.content)["data"]
+        self.assertEqual(result["created"], 2)
+        self.assertEqual([error["row"] for error in result["errors"]], [3])
+        self.assertIn("user_name", result["errors"][0]["errors"])
+        user = Users.objects.get(user_name="user3")
+        self.assertEqual((user.dept_id, user.position_id), (2, 1))
+        self.assertEqual(list(user.roles.values_list("role_id", flat=True)), [1])
+        self.assertTrue(user.check_password(DEFAULT_PASSWORD))
+        # 导入后清除了不存在缓存
+        self.assertEqual(lookup_user("user3"), user)
+        response = self.api_client.post(
+            "/system/user/import/",
+            data={
+                "users": [
+                    {"user_name": "user5", "nick_name": "用户5", "phone": "13000000006"},
+                    {"user_name": "user5", "nick_name": "用户5", "phone": "13000000007"},
+                    {"user_name": "user6", "nick_name": "用户6", "phone": "abc", "roles": [9]},
+                    {"user_name": "user7", "nick_name": "用户7", "phone": "13000000003"},
+                    # 无法解密的密码只记为该行的错误
+                    {
+                        "user_name": "user8",
+                        "nick_name": "用户8",
+                        "phone": "13000000008",
+                        "password": "abc",
+                    },
+                ]
+            },
+            format="json",
+        )
+        result = json.loads(response.content)["data"]
+        self.assertEqual(result["created"], 1)
+        errors = {error["row"]: error["errors"] for error in result["errors"]}
+        self.assertEqual(sorted(errors), [2, 3, 4, 5])
+        self.assertEqual(sorted(errors[3]), ["phone"])
+        self.assertEqual(list(errors[4]), ["phone"])
+        self.assertEqual(list(errors[5]), ["password"])
+        self.assertFalse(Users.objects.filter(user_name="user8").exists())
+
+
+class LoginLimiterTest(SimpleTestCase):
+    def test_sliding_window(self):
+        limiter = LoginLimiter(LocalSlidingWindow(), 60, 2, 3)
+        limiter.check("admin", "1.1.1.1")
+        self.assertEqual(limiter.record_failure("admin", "1.1.1.1"), [1, 1])
+        self.assertEqual(limiter.record_failure("admin", "1.1.1.1"), [2, 2])
+        with self.assertRaises(LoginLocked) as ctx:
+            limiter.check("admin", "2.2.2.2")
+        self.assertLessEqual(ctx.exception.wait, 60)
+        limiter.reset("admin")
+        limiter.check("admin", "1.1.1.1")
+        limiter.record_failure("other", "1.1.1.1")
+        # 同一IP的失败次数达到限制
+        with self.assertRaises(LoginLocked):
+            limiter.check("admin", "1.1.1.1")
+        stats = limiter.stats()
+        self.assertEqual((stats["failures"], stats["blocked"]), (3, 2))
+
+    def test_client_ip(self):
+        limiter = LoginLimiter(LocalSlidingWindow(), 60, 100, 2)
+        factory = RequestFactory()
+        # 每次伪造不同的X-Forwarded-For, 仍按REMOTE_ADDR计数
+        for forwarded in ("1.1.1.1", "2.2.2.2, 3.3.3.3"):
+            request = factory.post("/", HTTP_X_FORWARDED_FOR=forwarded, REMOTE_ADDR="9.9.9.9")
+            self.assertEqual(limiter.client_ip(request), "9.9.9.9")
+            limiter.record_failure("user-" + forwarded, limiter.client_ip(request))
+        request = factory.post("/", HTTP_X_FORWARDED_FOR="4.4.4.4", REMOTE_ADDR="9.9.9.9")
+        with self.assertRaises(LoginLocked):
+            limiter.check("admin", limiter.client_ip(request))
+        # 一层代理时取代理追加的地址, 不合法的地址不参与IP计数
+        limiter.num_proxies = 1
+        request = factory.post("/", HTTP_X_FORWARDED_FOR="1.1.1.1, 5.5.5.5", REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(limiter.client_ip(request), "5.5.5.5")
+        request = factory.post("/", HTTP_X_FORWARDED_FOR="x" * 1000, REMOTE_ADDR="10.0.0.1")
+        self.assertIsNone(limiter.client_ip(request))
+
+    def test_window_expiry(self):
+        backend = LocalSlidingWindow()
+        backend.record(["a"], 100, 10)
+        backend.record(["a"], 105, 10)
+        self.assertEqual(backend.check(["a"], 112, 10), [(1, 105)])
+
+
+class CredentialPoolTest(SimpleTestCase):
+    def test_back_pressure(self):
+        pool = CredentialPool(1, 1, 5)
+        release = threading.Event()
+        running = pool.submit(release.wait)
+        queued = pool.submit(lambda: "done")
+        with self.assertRaises(CredentialPoolBusy):
+            pool.submit(lambda: None)
+        self.assertEqual(pool.stats()["in_flight"], 2)
+        self.assertEqual(pool.stats()["rejected"], 1)
+        release.set()
+        self.assertEqual(queued.result(timeout=5), "done")
+        running.result(timeout=5)
+        self.assertEqual(asyncio.run(pool.arun(sum, [1, 2])), 3)
+        stats = pool.stats()
+        self.assertEqual((stats["in_flight"], stats["completed"]), (0, 3))
+
+    def test_run_timeout(self):
+        pool = CredentialPool(1, 1, 0.05)
+        release = threading.Event()
+        with self.assertRaises(CredentialPoolBusy):
+            pool.run(release.wait)
+        release.set()
+        self.assertEqual(pool.stats()["timed_out"], 1)
+        self.assertEqual(pool.run(sum, [1, 2]), 3)
+
+    def test_map(self):
+        pool = CredentialPool(2, 0, 5)
+        self.assertEqual(pool.map(abs, list(range(-10, 0)), chunk_size=3), list(range(10, 0, -1)))
+        # 默认同时执行的任务数为线程数的一半, 不会超过队列限制
+        self.assertEqual(pool.stats()["rejected"], 0)
+        self.assertEqual(pool.stats()["completed"], 4)
+
+
+class JSONRendererTest(SimpleTestCase):
+    def render(self, data, status_code=200):
+        return FitJSONRenderer().render(
+            data, "application/json", {"response": Response(status=status_code)}
+        )
+
+    def test_byte_compatible(self):
+        samples = [
+            {"user_name": "管理员", "text": "a\u2028b\u2029c\"\\/", "ok": True, "none": None},
+            [1, -2, 0.1, 2.0, 0.0001, 123456789.123],
+            [1e16],
+            [-1e-05],
+            {"at": datetime.datetime(2020, 10, 20, 10, 20, 30, 123456), "day": datetime.date(2020, 10, 20)},
+            {"price": decimal.Decimal("1.50"), "id": uuid.UUID(int=1), "lazy": gettext_lazy("name")},
+            {1: "int key", "big": 2 ** 70},
+            OrderedDict(detail=ErrorDetail("错误", code="invalid")),
+        ]
+        for data in samples:
+            expected = JSONRenderer().render({"code": 200, "data": data, "msg": None})
+            self.assertEqual(self.render(data), expected)
+        expected = JSONRenderer().render({"code": 400, "data": None, "msg": ["错误"]})
+        self.assertEqual(self.render({"detail": ErrorDetail("错误")}, 400), expected)
+
+    def test_raw_json(self):
+        data = [{"menu_id": 1, "children": []}]
+        expected = JSONRenderer().render({"code": 200, "data": data, "msg": None})
+        self.assertEqual(self.render(encode_json(data)), expected)
+        # 缩进时解码后由标准库编码
+        body = FitJSONRenderer().render(
+            encode_json(data), "application/json; indent=2", {"response": Response()}
+        )
+        self.assertEqual(json.loads(body)["data"], data)
+
+    def test_error_language(self):
+        errors = {
+            "user_name": JSON_ACCOUNT_VALIDATION_ERROR,
+            "phone": [ErrorDetail("This field is required."), ErrorDetail("手机号码已经被注册.")],
+        }
+        response = Response(status=400)
+        body = json.loads(FitJSONRenderer().render(errors, None, {"response": response}))
+        # 未指定语言时与之前的格式一致
+        self.assertEqual(
+            body["msg"],
+            [JSON_ACCOUNT_VALIDATION_ERROR, dict.fromkeys(["JP", "CN", "US"], "手机号码已经被注册.")],
+        )
+        request = RequestFactory().post("/", HTTP_ACCEPT_LANGUAGE="fr;q=1, ja;q=0.8, en;q=0.5")
+        body = json.loads(
+            FitJSONRenderer().render(errors, None, {"response": response, "request": request})
+        )
+        self.assertEqual(
+            body["msg"],
+            [{"JP": "アカウントが存在する."}, {"JP": "携帯電話の番号は既に登録されている."}],
+        )
+        self.assertEqual(get_language("zh-CN,zh;q=0.9,en;q=0.8"), "CN")
+        self.assertIsNone(get_language("fr"))
+
+
+class TreeUtilTest(SimpleTestCase):
+    @staticmethod
+    def make_nodes(count):
+        # 每个节点挂在前一半节点之下, 深度约为log2(count)
+        return [
+            {"id": i, "pid": (i // 2 if i > 1 else None), "sort": -i}
+            for i in range(1, count + 1)
+        ]
+
+    def test_build_tree(self):
+        roots = build_tree(self.make_nodes(7), "id", sort_key=lambda n: n["sort"])
+        self.assertEqual(len(roots), 1)
+        self.assertEqual([n["id"] for n in roots[0]["children"]], [3, 2])
+        self.assertEqual([n["id"] for n in roots[0]["children"][1]["children"]], [5, 4])
+        self.assertNotIn("children", roots[0]["children"][0]["children"][0])
+
+    def test_build_tree_linear(self):
+        class CountingNode(dict):
+            reads = 0
+
+            def __getitem__(self, key):
+                CountingNode.reads += 1
+                return super().__getitem__(key)
+
+        for count in (1000, 10000):
+            nodes = [CountingNode(node) for node in self.make_nodes(count)]
+            CountingNode.reads = 0
+            build_tree(nodes, "id")
+            # 每个节点只按pid建索引、按id取子节点各读一次, 与节点数成线性
+            self.assertEqual(CountingNode.reads, 2 * count)
+
+
+class RSAKeyManagerTest(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "private_key.pem")
+        self.write_key(RSA.generate(1024))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_key(self, key):
+        self.key = key
+        with open(self.path, "wb") as f:
+            f.write(key.export_key())
+
+    def encrypt(self, message):
+        return PKCS1_v1_5.new(self.key.publickey()).encrypt(message)
+
+    def test_key_rotation(self):
+        manager = RSAKeyManager(self.path, 0)
+        self.assertEqual(manager.cipher().decrypt(self.encrypt(b"123456"), None), b"123456")
+        self.assertIs(manager.cipher(), manager.cipher())
+        self.assertEqual(manager.version, 1)
+        self.write_key(RSA.generate(1024))
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(manager.cipher().decrypt(self.encrypt(b"abc"), None), b"abc")
+        self.assertEqual(manager.version, 2)
+
+    def test_decode_cached(self):
+        text = base64.b64encode(self.encrypt(b"123456"))
+        manager = RSAKeyManager(self.path, 5)
+        with mock.patch("utils.crypto_util.RSA.importKey", wraps=RSA.importKey) as import_key:
+            for _ in range(50):
+                self.assertEqual(
+                    manager.cipher().decrypt(base64.b64decode(text), None), b"123456"
+                )
+        # 只在首次调用时读取文件与解析PEM
+        self.assertEqual(import_key.call_count, 1)
@@ -13,6 +13,9 @@ from .views import (
     MyTokenObtainPairView,
     PositionViewSet,
     LogoutView,
+    CacheStatsView,
+    CredentialPoolStatsView,
+    LoginLimiterStatsView,
 )
 
 router = routers.DefaultRouter()
@@ -32,4 +35,7 @@ urlpatterns = [
     path("roleTest/", TestRoleView.as_view()),
     path("login/", MyTokenObtainPairView.as_view()),
     path("logout/", LogoutView.as_view()),
+    path("cache/stats/", CacheStatsView.as_view()),
+    path("credential_pool/stats/", CredentialPoolStatsView.as_view()),
+    path("login/limiter/stats/", LoginLimiterStatsView.as_view()),
 ]
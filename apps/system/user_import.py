@@ -0,0 +1,234 @@
+# author:hao.lu
+# create_date: 10/19/2020 2:40 PM
+# file : user_import.py
+# IDE: PyCharm
+
+# ! -*- coding: utf-8 -*-
+import csv
+import io
+import logging
+
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from rest_framework.exceptions import ValidationError
+
+from utils.constant import (
+    DEFAULT_PASSWORD,
+    JSON_ACCOUNT_VALIDATION_ERROR,
+    JSON_EMAIL_REGISTERED_VALIDATION_ERROR,
+    JSON_PHONE_REGISTERED_VALIDATION_ERROR,
+)
+from utils.credential_pool import credential_pool
+from utils.crypto_util import rsa_decode
+from .authentication import forget_missing
+from .models import Dept, Position, Role, Users
+from .serializers import UserImportSerializer
+
+logger = logging.getLogger("log")
+
+IMPORT_BATCH_SIZE = 1000
+# 每个hash任务计算的密码数
+HASH_CHUNK_SIZE = 20
+# 唯一字段与重复时的提示
+UNIQUE_FIELDS = [
+    ("user_name", JSON_ACCOUNT_VALIDATION_ERROR),
+    ("phone", JSON_PHONE_REGISTERED_VALIDATION_ERROR),
+    ("email", JSON_EMAIL_REGISTERED_VALIDATION_ERROR),
+]
+# 关联字段, (字段, 模型, 是否多值)
+RELATED_FIELDS = [
+    ("dept", Dept, False),
+    ("position", Position, False),
+    ("roles", Role, True),
+]
+DOES_NOT_EXIST = 'Invalid pk "{}" - object does not exist.'
+PASSWORD_DECODE_ERROR = "Password could not be decrypted."
+
+
+def parse_rows(request):
+    """
+    解析导入数据
+    上传csv文件(file字段)时首行为表头, roles用分号分隔;
+    否则请求体为用户列表或 {"users": [...]}
+
+    Returns: 行数据列表
+
+    """
+    upload = request.FILES.get("file")
+    if upload is None:
+        rows = request.data
+        if isinstance(rows, dict):
+            rows = rows.get("users")
+        if not isinstance(rows, list):
+            raise ValidationError({"users": ["This field is required."]})
+        return rows
+    try:
+        content = io.TextIOWrapper(upload.file, encoding="utf-8-sig")
+        rows = []
+        for row in csv.DictReader(content):
+            row = {key: value for key, value in row.items() if key and value != ""}
+            if "roles" in row:
+                row["roles"] = [role for role in row["roles"].split(";") if role]
+            rows.append(row)
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ValidationError({"file": [str(e)]})
+    return rows
+
+
+def _hash_password(password):
+    """
+    在credential_pool中执行, 加密的密码先解密, 未提供密码时使用默认密码
+    Returns: hash后的密码, 无法解密时返回None, 由调用方记为该行的错误
+
+    """
+    if not password:
+        return make_password(DEFAULT_PASSWORD)
+    try:
+        password = rsa_decode(password)
+    except (ValueError, AttributeError):
+        # base64格式错误、密文长度错误, 或解密失败时cipher返回None
+        return None
+    return make_password(password)
+
+
+class UserImporter:
+    """
+    批量导入用户
+    每行先做格式校验, 唯一性与关联对象按字段各一次IN查询,
+    密码hash分批在credential_pool中并行计算, 用户与角色关联各一次bulk_create
+    校验失败或密码无法解密的行不导入, 以行号返回错误
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.errors = {}
+
+    def _add_error(self, index, field, message):
+        self.errors.setdefault(index, {}).setdefault(field, []).append(message)
+
+    def _validate_rows(self):
+        valid = {}
+        for index, row in enumerate(self.rows):
+            if not isinstance(row, dict):
+                self._add_error(index, "non_field_errors", "Invalid data.")
+                continue
+            serializer = UserImportSerializer(data=row)
+            if serializer.is_valid():
+                valid[index] = serializer.validated_data
+            else:
+                self.errors[index] = serializer.errors
+        return valid
+
+    def _check_unique(self, valid):
+        for field, message in UNIQUE_FIELDS:
+            seen = {}
+            for index, data in valid.items():
+                value = data.get(field)
+                if value is None:
+                    continue
+                if value in seen:
+                    self._add_error(index, field, message)
+                else:
+                    seen[value] = index
+            if not seen:
+                continue
+            lookup = {"{}__in".format(field): list(seen)}
+            for value in Users.objects.filter(**lookup).values_list(field, flat=True):
+                self._add_error(seen[value], field, message)
+
+    def _check_related(self, valid):
+        for field, model, many in RELATED_FIELDS:
+            ids = set()
+            for data in valid.values():
+                value = data.get(field)
+                if value:
+                    ids.update(value if many else [value])
+            if not ids:
+                continue
+            existing = set(
+                model.objects.filter(pk__in=ids).values_list("pk", flat=True)
+            )
+            for index, data in valid.items():
+                value = data.get(field)
+                for pk in (value if many else [value]) if value else []:
+                    if pk not in existing:
+                        self._add_error(index, field, DOES_NOT_EXIST.format(pk))
+
+    def run(self):
+        """
+        Returns: {"created": 导入数, "errors": [{"row": 行号(从1开始), "errors": {...}}]}
+        """
+        valid = self._validate_rows()
+        self._check_unique(valid)
+        self._check_related(valid)
+        rows = [
+            (index, data) for index, data in valid.items() if index not in self.errors
+        ]
+        if rows:
+            rows = self._hash_passwords(rows)
+        if rows:
+            self._create(rows)
+        return {
+            "created": len(rows),
+            "errors": [
+                {"row": index + 1, "errors": errors}
+                for index, errors in sorted(self.errors.items())
+            ],
+        }
+
+    def _hash_passwords(self, rows):
+        """
+        Returns: [(行下标, 数据, hash后的密码)], 不含密码无法解密的行
+        """
+        passwords = credential_pool.map(
+            _hash_password,
+            [data.get("password") for _, data in rows],
+            chunk_size=HASH_CHUNK_SIZE,
+        )
+        hashed = []
+        for (index, data), password in zip(rows, passwords):
+            if password is None:
+                self._add_error(index, "password", PASSWORD_DECODE_ERROR)
+            else:
+                hashed.append((index, data, password))
+        return hashed
+
+    def _create(self, rows):
+        users = [
+            Users(
+                user_name=data["user_name"],
+                nick_name=data["nick_name"],
+                gender=data.get("gender") or None,
+                phone=data["phone"],
+                email=data.get("email"),
+                dept_id=data.get("dept"),
+                position_id=data.get("position"),
+                is_activate=data["is_activate"],
+                password=password,
+            )
+            for _, data, password in rows
+        ]
+        try:
+            with transaction.atomic():
+                Users.objects.bulk_create(users, batch_size=IMPORT_BATCH_SIZE)
+                # 不是所有数据库都返回bulk_create的主键, 按用户名取回
+                user_ids = dict(
+                    Users.objects.filter(
+                        user_name__in=[user.user_name for user in users]
+                    ).values_list("user_name", "id")
+                )
+                through = Users.roles.through
+                through.objects.bulk_create(
+                    [
+                        through(users_id=user_ids[data["user_name"]], role_id=role_id)
+                        for _, data, _ in rows
+                        for role_id in set(data.get("roles") or [])
+                    ],
+                    batch_size=IMPORT_BATCH_SIZE,
+                )
+        except IntegrityError as e:
+            # 校验与写入之间有并发写入
+            logger.warning("user import conflict: %s", e)
+            raise ValidationError({"non_field_errors": [JSON_ACCOUNT_VALIDATION_ERROR]})
+        # bulk_create不触发post_save, 单独清除登录标识的不存在缓存
+        forget_missing(*users)
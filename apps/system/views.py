@@ -1,7 +1,8 @@
 import logging
 
 from django.contrib.auth.hashers import check_password, make_password
-from django.core.cache import cache
+from django.http import HttpResponseNotModified
+from django.utils.http import parse_etags
 from notifications.signals import notify
 from rest_framework import status
 from rest_framework.decorators import action
@@ -11,21 +12,34 @@ from rest_framework.viewsets import ModelViewSet
 from rest_framework_simplejwt.serializers import TokenRefreshSerializer
 from rest_framework_simplejwt.views import TokenViewBase, TokenObtainPairView
 
-from apps.system.rbac_perm import RbacPermission
-from apps.system.service import MenuBuildService, DeptBuildService
+from apps.system import perm_cache
+from apps.system.login_limiter import login_limiter
+from apps.system.rbac_perm import RbacPermission, filter_data_scope
+from apps.system.service import (
+    DeptBuildService,
+    backfill_dict_fullname,
+    dict_snapshot,
+    menu_build_service,
+    menu_tree_cache,
+)
 from utils.constant import (
     DEFAULT_PASSWORD,
     JSON_PASSWORD_CHANGE_VALIDATION,
     JSON_PASSWORD_CONSISTENT_VALIDATION_ERROR,
     JSON_PASSWORD_VALIDATION_ERROR,
 )
+from utils.credential_pool import credential_pool
+from utils.export import stream_export
 from utils.crypto_util import rsa_decode
-from utils.pagination import MyPagination
+from utils.local_cache import local_cache
+from utils.pagination import MyPagination, PaginationModeMixin
 from utils.querySetUtil import get_child_queryset2
 from .models import Dict, DictType, Dept, Role, Users, Position, Menu
+from .user_import import UserImporter, parse_rows
 from .serializers import (
     MyTokenObtainPairSerializer,
     DictSerializer,
+    DictCorrectSerializer,
     DictTypeSerializer,
     RoleSerializer,
     DeptSerializer,
@@ -39,7 +53,6 @@ from .serializers import (
 
 logger = logging.getLogger("log")
 
-menu_build_service = MenuBuildService()
 dept_build_service = DeptBuildService()
 
 
@@ -92,11 +105,49 @@ class LogoutView(APIView):
         if serializer:
             serializer.is_valid(raise_exception=False)
             user_name = serializer.data["user_name"]
-            cache.delete(user_name + "__token")
-            cache.delete(user_name + "__perms")
+            user_id = (
+                Users.objects.filter(user_name=user_name)
+                .values_list("id", flat=True)
+                .first()
+            )
+            if user_id:
+                perm_cache.close_session(user_id)
         return Response(status=status.HTTP_200_OK)
 
 
+class CacheStatsView(APIView):
+    """
+    进程内缓存命中统计
+    """
+
+    perms_map = {"get": "monitor_view"}
+
+    def get(self, request, *args, **kwargs):
+        return Response(local_cache.stats())
+
+
+class CredentialPoolStatsView(APIView):
+    """
+    密码hash线程池队列统计
+    """
+
+    perms_map = {"get": "monitor_view"}
+
+    def get(self, request, *args, **kwargs):
+        return Response(credential_pool.stats())
+
+
+class LoginLimiterStatsView(APIView):
+    """
+    登录限流统计
+    """
+
+    perms_map = {"get": "monitor_view"}
+
+    def get(self, request, *args, **kwargs):
+        return Response(login_limiter.stats())
+
+
 class PositionViewSet(ModelViewSet):
     """
     岗位-增删改查
@@ -245,8 +296,9 @@ class MenuViewSet(ModelViewSet):
         users = Users.objects.filter(
             id=user_id, is_activate=True, is_deleted=False
         ).first()
-        result = menu_build_service.get_role_menus(users)
-        return Response(result)
+        if users is None:
+            return Response([])
+        return Response(menu_tree_cache.get(users))
 
     @action(
         methods=["get"],
@@ -341,20 +393,65 @@ class DictViewSet(ModelViewSet):
             return None
         return self.paginator.paginate_queryset(queryset, self.request, view=self)
 
+    @action(methods=["get"], detail=False, url_path="batch")
+    def batch(self, request):
+        """
+        一次返回多个字典类型的字典, codes: 逗号分隔的字典类型code, 不传时返回全部
+        返回ETag, 请求头If-None-Match与之相同时返回304
+        """
+        codes = request.query_params.get("codes")
+        codes = sorted({code for code in codes.split(",") if code}) if codes else None
+        version = dict_snapshot.version()
+        etag = dict_snapshot.etag(version, codes)
+        tags = parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+        if "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]:
+            response = HttpResponseNotModified()
+        else:
+            response = Response(dict_snapshot.render(version, codes))
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
+        return response
+
     @action(
-        methods=["get"],
+        methods=["post"],
         detail=False,
-        permission_classes=[],
-        authentication_classes=[],
+        perms_map={"post": "dict_correct"},
+        url_path="correct",
         url_name="correct_dict",
     )
-    def correct(self, request):
-        for i in Dict.objects.all():
-            i.save()
-        return Response(status=status.HTTP_200_OK)
+    def dict_correct(self, request):
+        """
+        分批重新计算fullname, 每次请求最多执行max_chunks批
+        返回next_id时以start_id=next_id再次请求继续, 全部数据建议使用backfill_dict_fullname命令
+        """
+        serializer = DictCorrectSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(backfill_dict_fullname(**serializer.validated_data))
+
+    @action(
+        methods=["get"], detail=False, perms_map={"get": "dict_export"}, url_path="export"
+    )
+    def dict_export(self, request):
+        """
+        流式导出数据字典, file_type: csv(默认) 或 ndjson
+        """
+        fields = [
+            ("dict_id", "dict_id"),
+            ("dict_name", "dict_name"),
+            ("code", "code"),
+            ("fullname", "fullname"),
+            ("dict_type", "dict_type__code"),
+            ("parent_id", "parent_id"),
+            ("sort", "sort"),
+            ("description", "description"),
+        ]
+        queryset = self.filter_queryset(self.get_queryset()).order_by("dict_id")
+        return stream_export(
+            queryset, fields, request.query_params.get("file_type", "csv"), "dict"
+        )
 
 
-class UserViewSet(ModelViewSet):
+class UserViewSet(PaginationModeMixin, ModelViewSet):
     """
     用户管理-增删改查
     """
@@ -370,18 +467,9 @@ class UserViewSet(ModelViewSet):
     # filter_set_class = UserFilter
     search_fields = ["user_name", "phone", "email"]
     ordering_fields = ["-id"]
+    cursor_ordering = "-id"
     _paginator = MyPagination()
 
-    def paginate_queryset(self, queryset):
-        """
-        如果查询参数里没有page但有type或type__code时则不分页,否则请求分页
-        """
-        if self.paginator is None:
-            return None
-        elif not self.request.query_params.get("page", None):
-            return None
-        return self.paginator.paginate_queryset(queryset, self.request, view=self)
-
     def get_queryset(self):
         queryset = self.queryset
         if hasattr(self.get_serializer_class(), "setup_eager_loading"):
@@ -407,15 +495,80 @@ class UserViewSet(ModelViewSet):
 
         password = request.data["password"] if "password" in request.data else None
         if password:
-            password = make_password(rsa_decode(password))
+            password = credential_pool.run(self.encode_password, password)
         else:
             # 创建用户默认添加密码
-            password = make_password(DEFAULT_PASSWORD)
+            password = credential_pool.run(make_password, DEFAULT_PASSWORD)
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         serializer.save(password=password)
         return Response(serializer.data)
 
+    @action(
+        methods=["get"], detail=False, perms_map={"get": "user_export"}, url_path="export"
+    )
+    def user_export(self, request):
+        """
+        流式导出用户, 按数据权限过滤, file_type: csv(默认) 或 ndjson
+        """
+        fields = [
+            ("id", "id"),
+            ("user_name", "user_name"),
+            ("nick_name", "nick_name"),
+            ("gender", "gender"),
+            ("phone", "phone"),
+            ("email", "email"),
+            ("dept", "dept__dept_name"),
+            ("position", "position__position_name"),
+            ("is_activate", "is_activate"),
+            ("create_at", "create_at"),
+        ]
+        queryset = filter_data_scope(
+            self.filter_queryset(self.get_queryset()), request.user
+        )
+        return stream_export(
+            queryset, fields, request.query_params.get("file_type", "csv"), "users"
+        )
+
+    @action(
+        methods=["post"], detail=False, perms_map={"post": "user_import"}, url_path="import"
+    )
+    def user_import(self, request):
+        """
+        批量导入用户, 上传csv文件(file字段)或提交用户列表
+        校验通过的行全部导入, 其余行返回行号与错误
+        """
+        return Response(UserImporter(parse_rows(request)).run())
+
+    @staticmethod
+    def encode_password(password):
+        """
+        在credential_pool中执行, 解密后计算密码hash
+        """
+        return make_password(rsa_decode(password))
+
+    @staticmethod
+    def verify_change_password(old_password, new_password1, new_password2, encoded):
+        """
+        在credential_pool中执行, 校验旧密码并计算新密码hash
+        Args:
+            old_password: rsa加密后的旧密码
+            new_password1: rsa加密后的新密码
+            new_password2: rsa加密后的确认密码
+            encoded: 当前密码hash
+
+        Returns: (旧密码是否正确, 新密码hash, 两次新密码不一致时为None)
+
+        """
+        old_password = rsa_decode(old_password) if old_password else None
+        if not (old_password and check_password(old_password, encoded)):
+            return False, None
+        new_password1 = rsa_decode(new_password1) if new_password1 else None
+        new_password2 = rsa_decode(new_password2) if new_password2 else None
+        if new_password1 and new_password2 and (new_password1 == new_password2):
+            return True, make_password(new_password2)
+        return True, None
+
     @action(
         methods=["put"],
         detail=False,
@@ -428,24 +581,16 @@ class UserViewSet(ModelViewSet):
         """
         user = request.user
 
-        old_password = (
-            rsa_decode(request.data["old_password"])
-            if request.data["old_password"]
-            else None
+        valid, password = credential_pool.run(
+            self.verify_change_password,
+            request.data["old_password"],
+            request.data["new_password1"],
+            request.data["new_password2"],
+            user.password,
         )
-        if old_password and check_password(old_password, user.password):
-            new_password1 = (
-                rsa_decode(request.data["new_password1"])
-                if request.data["new_password1"]
-                else None
-            )
-            new_password2 = (
-                rsa_decode(request.data["new_password2"])
-                if request.data["new_password2"]
-                else None
-            )
-            if new_password1 and new_password2 and (new_password1 == new_password2):
-                user.set_password(new_password2)
+        if valid:
+            if password:
+                user.password = password
                 user.save()
                 return Response(
                     JSON_PASSWORD_CHANGE_VALIDATION, status=status.HTTP_200_OK
@@ -469,7 +614,7 @@ class UserViewSet(ModelViewSet):
     def reset_password(self, request, pk=None):
         if pk:
             user = Users.objects.get(id=pk)
-            user.set_password(DEFAULT_PASSWORD)
+            user.password = credential_pool.run(make_password, DEFAULT_PASSWORD)
             user.save()
             return Response(
                 JSON_PASSWORD_CHANGE_VALIDATION, status=status.HTTP_200_OK
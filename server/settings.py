@@ -122,6 +122,54 @@ CACHES = {
     }
 }
 
+# 进程内缓存配置, 位于redis之前缓存会话与权限, TTL为0时关闭
+LOCAL_CACHE = {
+    "MAX_SIZE": 10000,
+    "TTL": 30,
+    # 多个worker之间广播失效消息的redis频道
+    "CHANNEL": "local_cache:invalidate",
+}
+
+# RSA密钥文件, 相对路径基于BASE_DIR, 每隔CHECK_INTERVAL秒检查文件变更以支持密钥轮换
+RSA_KEY = {
+    "PUBLIC_KEY": "utils/public_key.pem",
+    "PRIVATE_KEY": "utils/private_key.pem",
+    "CHECK_INTERVAL": 5,
+}
+
+# 密码hash与RSA解密线程池, 执行中与排队的任务超过MAX_WORKERS + MAX_QUEUE时返回429
+CREDENTIAL_POOL = {
+    "MAX_WORKERS": 4,
+    "MAX_QUEUE": 32,
+    "TIMEOUT": 30,
+}
+
+# 登录失败限流, WINDOW秒内同一登录标识或IP的失败次数达到限制后返回429
+# NUM_PROXIES为应用前的反向代理层数, 部署在代理后时按实际层数配置, 否则X-Forwarded-For可被伪造
+LOGIN_LIMIT = {
+    "WINDOW": 5 * 60,
+    "IDENTIFIER_LIMIT": 5,
+    "IP_LIMIT": 50,
+    "NUM_PROXIES": 0,
+}
+
+# 分页总数, 小于EXACT_THRESHOLD时精确COUNT, 否则使用估算值或缓存TIMEOUT秒的COUNT结果
+PAGINATION_COUNT = {
+    "EXACT_THRESHOLD": 10000,
+    "TIMEOUT": 60,
+}
+
+# 通知广播, 后台线程按BATCH_SIZE批量插入, SYNC为True时在请求中同步发送
+NOTICE_BROADCAST = {
+    "BATCH_SIZE": 1000,
+    "SYNC": False,
+}
+
+# FitJSONRenderer的编码器, 默认使用orjson(可选依赖, 未安装时使用json标准库), 为None时只使用标准库
+JSON_RENDERER = {
+    "ENCODER": "utils.json_encoder.OrjsonEncoder",
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -1,8 +1,26 @@
 """
 https://github.com/caoqianming/django-vue-admin
 """
+import json
+
 from rest_framework.renderers import JSONRenderer
 
+from utils.json_encoder import json_encoder
+from utils.message_catalog import format_messages, get_language
+
+
+class RawJSON(bytes):
+    """
+    已编码的JSON, FitJSONRenderer直接拼接进返回结构, 不再解码和重新编码
+    """
+
+
+def encode_json(data):
+    """
+    按JSONRenderer的格式预先编码, 用于缓存已渲染的数据
+    """
+    return RawJSON(FitJSONRenderer().encode(data))
+
 
 class BaseResponse(object):
     """
@@ -22,8 +40,29 @@ class BaseResponse(object):
 class FitJSONRenderer(JSONRenderer):
     """
     自行封装的渲染器
+    紧凑输出时使用json_encoder(默认orjson)编码, 不可用或无法保证与标准库一致时回退到JSONRenderer
     """
 
+    def fast_path(self, accepted_media_type=None, renderer_context=None):
+        """
+        是否可以使用json_encoder, 缩进、非紧凑或转义非ASCII字符的输出由标准库编码
+        """
+        return (
+            json_encoder is not None
+            and self.compact
+            and not self.ensure_ascii
+            and self.get_indent(accepted_media_type, renderer_context or {}) is None
+        )
+
+    def encode(self, data, accepted_media_type=None, renderer_context=None):
+        if self.fast_path(accepted_media_type, renderer_context):
+            body = json_encoder.encode(data)
+            if body is not None:
+                return body
+        return super(FitJSONRenderer, self).render(
+            data, accepted_media_type, renderer_context
+        )
+
     def render(self, data, accepted_media_type=None, renderer_context=None):
         """
         如果使用这个render，
@@ -49,30 +88,19 @@ class FitJSONRenderer(JSONRenderer):
         response_body.code = response.status_code
         if response_body.code >= 400:  # 响应异常
             msg = data["detail"] if "detail" in data else data
-            if isinstance(msg, dict):
-                msg_list = []
-                msg_dict ={}
-                for k, v in msg.items():
-                    if isinstance(v, list):
-                        us_key_list = ["US"] * len(v)
-                        cn_key_list = ["CN"] * len(v)
-                        jp_key_list = ["JP"] * len(v)
-                        temp = dict(zip(us_key_list, v))
-                        temp = dict(zip(cn_key_list, v), **temp)
-                        temp = dict(zip(jp_key_list, v), **temp)
-                        msg_list.append(temp)
-                    elif k in ["US","CN","JP"]:
-                        msg_dict[k] = v
-                    else:
-                        msg_list.append(v)
-                if len(msg_dict) > 0:
-                    msg_list.append(msg_dict)
-                response_body.msg = msg_list
-            else:
-                response_body.msg = [msg]
+            request = renderer_context.get("request")
+            language = (
+                get_language(request.META.get("HTTP_ACCEPT_LANGUAGE"))
+                if request is not None
+                else None
+            )
+            response_body.msg = format_messages(msg, language)
+        elif isinstance(data, RawJSON):
+            if self.compact and self.get_indent(accepted_media_type, renderer_context) is None:
+                # 直接拼接, 与标准库编码 {"code":200,"data":...,"msg":null} 的结果一致
+                return b'{"code":%d,"data":%s,"msg":null}' % (response_body.code, data)
+            response_body.data = json.loads(data)
         else:
             response_body.data = data
         # renderer_context.get("response").status_code = 200  # 统一成200响应,用code区分
-        return super(FitJSONRenderer, self).render(
-            response_body.dict, accepted_media_type, renderer_context
-        )
+        return self.encode(response_body.dict, accepted_media_type, renderer_context)
@@ -0,0 +1,72 @@
+# author:hao.lu
+# create_date: 10/12/2020 10:05 AM
+# file : cache_version.py
+# IDE: PyCharm
+
+# ! -*- coding: utf-8 -*-
+import time
+
+from django.core.cache import cache
+
+VERSION_KEY_PREFIX = "ver:"
+
+
+def version_key(name):
+    """
+    版本号在缓存中的key
+    Args:
+        name: 版本号名称, example: perm, perm:role:1
+
+    Returns: 缓存key
+
+    """
+    return VERSION_KEY_PREFIX + name
+
+
+def _seed():
+    # 版本号被淘汰后以毫秒时间戳重新起步,保证不会与淘汰前的旧版本号重复
+    return int(time.time() * 1000)
+
+
+def get_versions(names):
+    """
+    一次缓存往返批量读取版本号,不存在的版本号会被初始化
+    Args:
+        names: 版本号名称集合
+
+    Returns: {name: version}
+
+    """
+    keys = {version_key(name): name for name in names}
+    found = cache.get_many(list(keys))
+    result = {}
+    for key, name in keys.items():
+        version = found.get(key)
+        if version is None:
+            cache.add(key, _seed(), timeout=None)
+            version = cache.get(key)
+        result[name] = version
+    return result
+
+
+def get_version(name):
+    return get_versions([name])[name]
+
+
+def bump_version(name):
+    """
+    版本号原子加一,使依赖该版本号的缓存全部失效
+    Args:
+        name: 版本号名称
+
+    Returns: 新的版本号
+
+    """
+    key = version_key(name)
+    cache.add(key, _seed(), timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # 在add与incr之间被淘汰
+        cache.set(key, _seed(), timeout=None)
+        return cache.get(key)
@@ -82,6 +82,15 @@ JSON_DEPT_VALIDATION_ERROR = {
     "CN": CN_DEPT_VALIDATION_ERROR,
 }
 
+EN_DEPT_PID_ERROR = "The department cannot be moved under itself or its sub department."
+JP_DEPT_PID_ERROR = "部門を自身またはその下位部門の下に移動できない."
+CN_DEPT_PID_ERROR = "部门不能移动到自身或其子部门下."
+JSON_DEPT_PID_ERROR = {
+    "US": EN_DEPT_PID_ERROR,
+    "JP": JP_DEPT_PID_ERROR,
+    "CN": CN_DEPT_PID_ERROR,
+}
+
 EN_POSITION_VALIDATION_ERROR = "The position already exists."
 JP_POSITION_VALIDATION_ERROR = "役職名は既に存在する."
 CN_POSITION_VALIDATION_ERROR = "职位名称已经存在."
@@ -182,3 +191,33 @@ JSON_NOTICE_CONTENT_IS_NULL_VALIDATION_ERROR = {
     "JP": JP_NOTICE_CONTENT_IS_NULL_VALIDATION_ERROR,
     "CN": CN_NOTICE_CONTENT_IS_NULL_VALIDATION_ERROR,
 }
+
+EN_NOTICE_RECIPIENT_IDS_VALIDATION_ERROR = "The recipient ids must be a list of user ids."
+JP_NOTICE_RECIPIENT_IDS_VALIDATION_ERROR = "受信ユーザIDはユーザIDのリストである必要がある."
+CN_NOTICE_RECIPIENT_IDS_VALIDATION_ERROR = "接收用户ID必须为用户ID列表."
+
+JSON_NOTICE_RECIPIENT_IDS_VALIDATION_ERROR = {
+    "US": EN_NOTICE_RECIPIENT_IDS_VALIDATION_ERROR,
+    "JP": JP_NOTICE_RECIPIENT_IDS_VALIDATION_ERROR,
+    "CN": CN_NOTICE_RECIPIENT_IDS_VALIDATION_ERROR,
+}
+
+EN_NOTICE_DEPT_ID_VALIDATION_ERROR = "The department id must be an integer."
+JP_NOTICE_DEPT_ID_VALIDATION_ERROR = "部門IDは整数である必要がある."
+CN_NOTICE_DEPT_ID_VALIDATION_ERROR = "部门ID必须为整数."
+
+JSON_NOTICE_DEPT_ID_VALIDATION_ERROR = {
+    "US": EN_NOTICE_DEPT_ID_VALIDATION_ERROR,
+    "JP": JP_NOTICE_DEPT_ID_VALIDATION_ERROR,
+    "CN": CN_NOTICE_DEPT_ID_VALIDATION_ERROR,
+}
+
+EN_NOTICE_ROLE_ID_VALIDATION_ERROR = "The role id must be an integer."
+JP_NOTICE_ROLE_ID_VALIDATION_ERROR = "ロールIDは整数である必要がある."
+CN_NOTICE_ROLE_ID_VALIDATION_ERROR = "角色ID必须为整数."
+
+JSON_NOTICE_ROLE_ID_VALIDATION_ERROR = {
+    "US": EN_NOTICE_ROLE_ID_VALIDATION_ERROR,
+    "JP": JP_NOTICE_ROLE_ID_VALIDATION_ERROR,
+    "CN": CN_NOTICE_ROLE_ID_VALIDATION_ERROR,
+}
@@ -0,0 +1,175 @@
+# author:hao.lu
+# create_date: 10/16/2020 9:40 AM
+# file : credential_pool.py
+# IDE: PyCharm
+
+# ! -*- coding: utf-8 -*-
+import asyncio
+import os
+import threading
+from concurrent.futures import (
+    ALL_COMPLETED,
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    TimeoutError,
+    wait,
+)
+
+from django.conf import settings
+from rest_framework.exceptions import Throttled
+
+DEFAULT_CREDENTIAL_POOL = {
+    "MAX_WORKERS": 4,
+    "MAX_QUEUE": 32,
+    "TIMEOUT": 30,
+}
+
+
+class CredentialPoolBusy(Throttled):
+    default_detail = "认证请求过多, 请稍后重试"
+
+
+class CredentialPool:
+    """
+    密码hash与RSA解密专用的有界线程池
+    PBKDF2与RSA运算在C扩展中释放GIL, 多个worker可以并行计算
+    执行中与排队的任务总数超过max_workers + max_queue时直接拒绝, 返回429, 避免登录风暴占满请求线程
+    """
+
+    def __init__(self, max_workers, max_queue, timeout):
+        """
+        Args:
+            max_workers: 线程数
+            max_queue: 最大排队任务数
+            timeout: 同步等待结果的超时时间(秒)
+        """
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.in_flight = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def _get_executor(self):
+        # fork出的worker进程不继承线程, 按进程创建线程池
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        self.max_workers, thread_name_prefix="credential"
+                    )
+                    self._pid = os.getpid()
+        return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        提交任务, 队列已满时抛出CredentialPoolBusy
+        Returns: concurrent.futures.Future
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise CredentialPoolBusy(wait=1)
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self._get_executor().submit(self._call, fn, args, kwargs)
+        except Exception:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _call(self, fn, args, kwargs):
+        with self._lock:
+            self.active += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def _done(self, future):
+        with self._lock:
+            self.in_flight -= 1
+            if future is not None and not future.cancelled():
+                self.completed += 1
+        self._slots.release()
+
+    def run(self, fn, *args, **kwargs):
+        """
+        同步执行, 在WSGI或ASGI的同步视图中使用
+        超时未完成时抛出CredentialPoolBusy, 尚未开始的任务被取消
+        """
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            raise CredentialPoolBusy(wait=1)
+
+    async def arun(self, fn, *args, **kwargs):
+        """
+        异步执行, 在ASGI的异步视图中使用, 等待期间不占用事件循环
+        """
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def map(self, fn, items, chunk_size=50, concurrency=None):
+        """
+        批量执行, 每个任务处理chunk_size个元素
+        同时执行的任务数不超过concurrency(默认为线程数的一半), 为登录等请求保留worker
+        Args:
+            fn: 处理单个元素的函数
+            items: 元素列表
+            chunk_size: 每个任务处理的元素数
+            concurrency: 同时执行的任务数
+
+        Returns: 结果列表, 与items顺序一致
+
+        """
+        concurrency = concurrency or max(1, self.max_workers // 2)
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        results = [None] * len(chunks)
+        pending = {}
+
+        def collect(return_when):
+            done, _ = wait(list(pending), return_when=return_when)
+            for future in done:
+                results[pending.pop(future)] = future.result()
+
+        for index, chunk in enumerate(chunks):
+            while len(pending) >= concurrency:
+                collect(FIRST_COMPLETED)
+            pending[self.submit(lambda chunk=chunk: [fn(item) for item in chunk])] = index
+        if pending:
+            collect(ALL_COMPLETED)
+        return [result for chunk_results in results for result in chunk_results]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "active": self.active,
+                "queued": self.in_flight - self.active,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
+
+
+def _build():
+    config = dict(DEFAULT_CREDENTIAL_POOL, **getattr(settings, "CREDENTIAL_POOL", {}))
+    return CredentialPool(config["MAX_WORKERS"], config["MAX_QUEUE"], config["TIMEOUT"])
+
+
+credential_pool = _build()
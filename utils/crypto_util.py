@@ -5,9 +5,92 @@
 
 # ! -*- coding: utf-8 -*-
 import base64
+import logging
+import os
+import threading
+import time
+from pathlib import Path
 
 from Crypto.Cipher import PKCS1_v1_5
 from Crypto.PublicKey import RSA
+from django.conf import settings
+
+logger = logging.getLogger("log")
+
+DEFAULT_RSA_KEY = {
+    "PUBLIC_KEY": "utils/public_key.pem",
+    "PRIVATE_KEY": "utils/private_key.pem",
+    "CHECK_INTERVAL": 5,
+}
+
+
+class RSAKeyManager:
+    """
+    每个进程只解析一次PEM文件并复用cipher对象
+    每隔check_interval秒检查文件的mtime/size/inode, 文件变更后重新加载, 支持不重启轮换密钥
+    """
+
+    def __init__(self, path, check_interval):
+        """
+        Args:
+            path: PEM文件路径, 相对路径基于BASE_DIR
+            check_interval: 检查文件变更的间隔(秒), 0表示每次调用都检查
+        """
+        path = Path(path)
+        self.path = path if path.is_absolute() else Path(settings.BASE_DIR) / path
+        self.check_interval = check_interval
+        # 版本号, 每次重新加载密钥后递增
+        self.version = 0
+        self._state = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def cipher(self):
+        """
+        Returns: PKCS1_v1_5 cipher对象
+        """
+        state = self._state
+        if state is None or time.monotonic() - self._checked_at >= self.check_interval:
+            state = self._refresh(state)
+        return state[1]
+
+    def preload(self):
+        self._refresh(self._state)
+
+    def _refresh(self, state):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            if state is None:
+                raise
+            # 轮换过程中文件短暂缺失时继续使用旧密钥
+            logger.warning("rsa key file %s missing, keep the loaded key", self.path)
+            return state
+        self._checked_at = time.monotonic()
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if state is not None and state[0] == stamp:
+            return state
+        with self._lock:
+            state = self._state
+            if state is None or state[0] != stamp:
+                with open(self.path) as f:
+                    rsa_key = RSA.importKey(f.read())
+                state = (stamp, PKCS1_v1_5.new(rsa_key))
+                self._state = state
+                self.version += 1
+                logger.info("rsa key %s loaded, version %s", self.path, self.version)
+        return state
+
+
+def _build():
+    config = dict(DEFAULT_RSA_KEY, **getattr(settings, "RSA_KEY", {}))
+    return (
+        RSAKeyManager(config["PUBLIC_KEY"], config["CHECK_INTERVAL"]),
+        RSAKeyManager(config["PRIVATE_KEY"], config["CHECK_INTERVAL"]),
+    )
+
+
+public_key_manager, private_key_manager = _build()
 
 
 def rsa_encode(message):
@@ -22,11 +105,7 @@ def rsa_encode(message):
     """
 
     # message_bytes = message.encode("utf-8")
-    with open("./utils/public_key.pem") as f:
-        public_key = f.read()
-    rsa_key = RSA.importKey(public_key)
-    cipher = PKCS1_v1_5.new(rsa_key)
-    encrypt_text = cipher.encrypt(message)
+    encrypt_text = public_key_manager.cipher().encrypt(message)
     cipher_text = base64.b64encode(encrypt_text).decode()
     return cipher_text
 
@@ -41,10 +120,6 @@ def rsa_decode(message):
     Returns:字符串, example: 4asasasasas
 
     """
-    with open("./utils/private_key.pem") as f:
-        private_key = f.read()
     text = base64.b64decode(message)
-    rsa_key = RSA.importKey(private_key)
-    cipher_rsa = PKCS1_v1_5.new(rsa_key)
-    decode_text = cipher_rsa.decrypt(text, None).decode()
+    decode_text = private_key_manager.cipher().decrypt(text, None).decode()
     return decode_text
@@ -0,0 +1,71 @@
+# author:hao.lu
+# create_date: 10/19/2020 9:30 AM
+# file : export.py
+# IDE: PyCharm
+
+# ! -*- coding: utf-8 -*-
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson; charset=utf-8",
+}
+
+
+class _Echo:
+    """
+    csv.writer的写入对象, 直接返回写入的行
+    """
+
+    def write(self, value):
+        return value
+
+
+def _csv_rows(headers, rows):
+    writer = csv.writer(_Echo())
+    # BOM, Excel按utf-8打开中文
+    yield "\ufeff" + writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _ndjson_rows(headers, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(headers, row)), ensure_ascii=False, cls=DjangoJSONEncoder) + "\n"
+
+
+def stream_export(queryset, fields, file_type, filename):
+    """
+    流式导出, 使用服务端游标分批读取, 内存占用与行数无关
+    Args:
+        queryset: 查询集
+        fields: [(列名, 字段)], 字段为values_list可用的lookup, example: ("dept", "dept__dept_name")
+        file_type: csv 或 ndjson
+        filename: 不含扩展名的文件名
+
+    Returns: StreamingHttpResponse
+
+    """
+    if file_type not in EXPORT_FORMATS:
+        raise ValidationError({"file_type": list(EXPORT_FORMATS)})
+    headers = [header for header, _ in fields]
+    rows = (
+        queryset.prefetch_related(None)
+        .values_list(*[field for _, field in fields])
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    if file_type == "csv":
+        content = _csv_rows(headers, rows)
+    else:
+        content = _ndjson_rows(headers, rows)
+    response = StreamingHttpResponse(content, content_type=EXPORT_FORMATS[file_type])
+    response["Content-Disposition"] = 'attachment; filename="{}.{}"'.format(
+        filename, file_type
+    )
+    return response
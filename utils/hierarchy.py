@@ -0,0 +1,231 @@
+# author:hao.lu
+# create_date: 10/15/2020 2:40 PM
+# file : hierarchy.py
+# IDE: PyCharm
+
+# ! -*- coding: utf-8 -*-
+import hashlib
+
+from django.core.cache import cache
+from django.db import connections, router
+
+from utils.cache_version import bump_version, get_version
+
+# 向上查找祖先的最大层数, 防止pid数据成环时无限递归
+MAX_DEPTH = 100
+SUBTREE_TIMEOUT = 60 * 60
+
+
+def supports_recursive_cte(connection):
+    """
+    PostgreSQL, SQLite(>=3.8.3)和MySQL 8 支持 WITH RECURSIVE
+    """
+    if connection.vendor == "mysql":
+        return not connection.mysql_is_mariadb and connection.mysql_version >= (8,)
+    return connection.vendor in ("postgresql", "sqlite")
+
+
+class Hierarchy:
+    """
+    树型结构查询, 适用于以pid整数列(Menu, Dept)或parent外键(DictType, Dict)关联父节点的模型
+    支持递归CTE的数据库每次调用只执行一条SQL, 否则逐层查询
+    """
+
+    def __init__(self, model, parent_field="pid"):
+        """
+        Args:
+            model: 树型结构的模型, 需包含parent_field与is_deleted字段
+            parent_field: 父节点字段名, example: pid, parent
+        """
+        self.model = model
+        self.parent_field = parent_field
+        self.version_name = "tree:" + model._meta.label_lower
+
+    @property
+    def connection(self):
+        return connections[router.db_for_read(self.model)]
+
+    def _columns(self):
+        qn = self.connection.ops.quote_name
+        opts = self.model._meta
+        return {
+            "table": qn(opts.db_table),
+            "pk": qn(opts.pk.column),
+            "pid": qn(opts.get_field(self.parent_field).column),
+            "is_deleted": qn(opts.get_field("is_deleted").column),
+        }
+
+    def _fetch(self, sql, params):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def descendant_ids(self, root_ids, include_root=False, cached=False):
+        """
+        获取所有未删除的子孙节点ID, 已删除节点的子孙不再向下查找
+        Args:
+            root_ids: 根节点ID集合
+            include_root: 是否包含根节点
+            cached: 是否按树版本号缓存结果
+
+        Returns: 节点ID列表
+
+        """
+        root_ids = list(root_ids)
+        if not root_ids:
+            return []
+        if cached:
+            key = self._subtree_key(root_ids)
+            ids = cache.get(key)
+            if ids is None:
+                ids = self._descendant_ids(root_ids)
+                cache.set(key, ids, SUBTREE_TIMEOUT)
+        else:
+            ids = self._descendant_ids(root_ids)
+        if include_root:
+            roots = set(root_ids)
+            ids = root_ids + [pk for pk in ids if pk not in roots]
+        return ids
+
+    def _descendant_ids(self, root_ids):
+        if not supports_recursive_cte(self.connection):
+            return self._descendant_ids_by_level(root_ids)
+        placeholders = ", ".join(["%s"] * len(root_ids))
+        sql = (
+            "WITH RECURSIVE tree (node_id) AS ("
+            "SELECT {pk} FROM {table} WHERE {pid} IN ({placeholders}) AND {is_deleted} = %s "
+            "UNION "
+            "SELECT child.{pk} FROM {table} child INNER JOIN tree ON child.{pid} = tree.node_id "
+            "WHERE child.{is_deleted} = %s"
+            ") SELECT node_id FROM tree"
+        ).format(placeholders=placeholders, **self._columns())
+        return [row[0] for row in self._fetch(sql, root_ids + [False, False])]
+
+    def _descendant_ids_by_level(self, root_ids):
+        result = []
+        seen = set(root_ids)
+        level = root_ids
+        while level:
+            level = [
+                pk
+                for pk in self.model.objects.filter(
+                    is_deleted=False, **{self.parent_field + "__in": level}
+                ).values_list("pk", flat=True)
+                if pk not in seen
+            ]
+            seen.update(level)
+            result.extend(level)
+        return result
+
+    def descendants(self, root_id, include_root=True):
+        """
+        Returns: 子孙节点QuerySet
+        """
+        ids = self.descendant_ids([root_id], include_root=include_root)
+        return self.model.objects.filter(pk__in=ids)
+
+    def ancestor_ids(self, node_id, include_self=False):
+        """
+        获取祖先节点ID, 由近及远排列
+        Args:
+            node_id: 节点ID
+            include_self: 是否包含节点本身
+
+        Returns: 节点ID列表
+
+        """
+        if supports_recursive_cte(self.connection):
+            sql = (
+                "WITH RECURSIVE tree (node_id, parent_id, depth) AS ("
+                "SELECT {pk}, {pid}, 0 FROM {table} WHERE {pk} = %s "
+                "UNION ALL "
+                "SELECT parent.{pk}, parent.{pid}, tree.depth + 1 FROM {table} parent "
+                "INNER JOIN tree ON parent.{pk} = tree.parent_id WHERE tree.depth < %s"
+                ") SELECT node_id FROM tree ORDER BY depth"
+            ).format(**self._columns())
+            ids = [row[0] for row in self._fetch(sql, [node_id, MAX_DEPTH])]
+        else:
+            ids = self._ancestor_ids_by_level(node_id)
+        return ids if include_self else ids[1:]
+
+    def _ancestor_ids_by_level(self, node_id):
+        ids = []
+        parent_column = self.model._meta.get_field(self.parent_field).attname
+        while node_id is not None and len(ids) <= MAX_DEPTH:
+            row = (
+                self.model.objects.filter(pk=node_id)
+                .values_list("pk", parent_column)
+                .first()
+            )
+            if row is None:
+                break
+            ids.append(row[0])
+            node_id = row[1]
+        return ids
+
+    def ancestor_ids_many(self, node_ids, include_self=True):
+        """
+        一次查询获取多个节点的全部祖先ID
+        Args:
+            node_ids: 节点ID集合
+            include_self: 是否包含节点本身
+
+        Returns: 节点ID集合
+
+        """
+        node_ids = list(node_ids)
+        if not node_ids:
+            return set()
+        if supports_recursive_cte(self.connection):
+            placeholders = ", ".join(["%s"] * len(node_ids))
+            # UNION去重, 共享祖先只展开一次, pid数据成环时同样会终止
+            sql = (
+                "WITH RECURSIVE tree (node_id, parent_id) AS ("
+                "SELECT {pk}, {pid} FROM {table} WHERE {pk} IN ({placeholders}) "
+                "UNION "
+                "SELECT parent.{pk}, parent.{pid} FROM {table} parent "
+                "INNER JOIN tree ON parent.{pk} = tree.parent_id"
+                ") SELECT node_id FROM tree"
+            ).format(placeholders=placeholders, **self._columns())
+            ids = {row[0] for row in self._fetch(sql, node_ids)}
+        else:
+            ids = self._ancestor_ids_many_by_level(node_ids)
+        if not include_self:
+            ids.difference_update(node_ids)
+        return ids
+
+    def _ancestor_ids_many_by_level(self, node_ids):
+        ids = set()
+        level = set(node_ids)
+        parent_column = self.model._meta.get_field(self.parent_field).attname
+        for _ in range(MAX_DEPTH + 1):
+            if not level:
+                break
+            rows = list(
+                self.model.objects.filter(pk__in=level).values_list(
+                    "pk", parent_column
+                )
+            )
+            ids.update(pk for pk, _ in rows)
+            level = {pid for _, pid in rows if pid is not None and pid not in ids}
+        return ids
+
+    def depth(self, node_id):
+        """
+        Returns: 节点深度, 根节点为0
+        """
+        return len(self.ancestor_ids(node_id))
+
+    def _subtree_key(self, root_ids):
+        ids = ",".join(str(pk) for pk in sorted(root_ids))
+        return "tree:{}:{}:{}".format(
+            self.model._meta.label_lower,
+            get_version(self.version_name),
+            hashlib.md5(ids.encode()).hexdigest(),
+        )
+
+    def bump(self):
+        """
+        树结构变更时调用, 使缓存的子树全部失效
+        """
+        bump_version(self.version_name)
@@ -0,0 +1,71 @@
+# author:hao.lu
+# create_date: 10/20/2020 10:20 AM
+# file : json_encoder.py
+# IDE: PyCharm
+
+# ! -*- coding: utf-8 -*-
+import logging
+import re
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework.utils import encoders
+
+logger = logging.getLogger("log")
+
+DEFAULT_JSON_RENDERER = {
+    # 编码器类的路径, 为None时只使用json标准库
+    "ENCODER": "utils.json_encoder.OrjsonEncoder",
+}
+
+# 与json标准库格式不同的浮点数: 科学计数法(1e16 / 1e+16)与小于1e-4的小数(0.00001 / 1e-05),
+# 输出中出现时回退到标准库
+FLOAT_MISMATCH = re.compile(rb"[:\[,]-?(?:\d+(?:\.\d+)?e[-+]?\d+|0\.0000\d+)(?=[,\]}])")
+# 以字面量开头, 快速排除不含上述浮点数的输出
+EXPONENT_HINT = re.compile(rb"e[-+]?\d")
+
+
+class OrjsonEncoder:
+    """
+    orjson编码, 输出与JSONRenderer在COMPACT_JSON、UNICODE_JSON下逐字节一致
+    orjson不支持的类型(datetime、Decimal、惰性翻译字符串等)交给DRF的JSONEncoder.default转换,
+    无法保证一致时(非字符串的key、超过64位的整数、格式不同的浮点数)返回None, 由渲染器回退到标准库
+    NaN与Infinity编码为null, 不像STRICT_JSON下的标准库那样抛出异常
+    """
+
+    def __init__(self):
+        import orjson
+
+        self._dumps = orjson.dumps
+        self._error = orjson.JSONEncodeError
+        self._option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        self._default = encoders.JSONEncoder().default
+
+    def encode(self, data):
+        """
+        Returns: 编码后的bytes, 无法保证与标准库一致时返回None
+        """
+        try:
+            body = self._dumps(data, default=self._default, option=self._option)
+        except self._error:
+            return None
+        if (b"0.0000" in body or EXPONENT_HINT.search(body)) and FLOAT_MISMATCH.search(body):
+            return None
+        if b"\xe2\x80" in body:
+            # 与JSONRenderer一样转义, 输出为javascript的严格子集
+            body = body.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+        return body
+
+
+def _build():
+    config = dict(DEFAULT_JSON_RENDERER, **getattr(settings, "JSON_RENDERER", {}))
+    if not config["ENCODER"]:
+        return None
+    try:
+        return import_string(config["ENCODER"])()
+    except ImportError:
+        logger.info("json encoder %s not available, use json", config["ENCODER"])
+        return None
+
+
+json_encoder = _build()
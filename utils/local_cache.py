@@ -0,0 +1,171 @@
+# author:hao.lu
+# create_date: 10/14/2020 10:12 AM
+# file : local_cache.py
+# IDE: PyCharm
+
+# ! -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+logger = logging.getLogger("log")
+
+MISSING = object()
+
+DEFAULT_LOCAL_CACHE = {
+    "MAX_SIZE": 10000,
+    "TTL": 30,
+    "CHANNEL": "local_cache:invalidate",
+}
+
+
+class LocalCache:
+    """
+    进程内LRU缓存, 条目超过TTL后失效, 超过MAX_SIZE时淘汰最久未使用的条目
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Args:
+            key: 缓存key
+
+        Returns: 缓存值, 不存在或已过期时返回MISSING
+
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0,
+            }
+
+
+class InvalidationBus:
+    """
+    通过redis pub/sub在多个worker进程间广播失效消息
+    非django_redis后端时仅在本进程内失效, 其他进程依赖TTL
+    """
+
+    def __init__(self, local_cache, channel, alias="default"):
+        self.local_cache = local_cache
+        self.channel = channel
+        self.alias = alias
+        self.enabled = "django_redis" in settings.CACHES[alias]["BACKEND"]
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _client(self):
+        from django_redis import get_redis_connection
+
+        return get_redis_connection(self.alias)
+
+    def ensure_listener(self):
+        """
+        按进程启动订阅线程, fork出的worker需要各自订阅
+        """
+        if not self.enabled or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            thread = threading.Thread(
+                target=self._listen, name="local-cache-invalidation", daemon=True
+            )
+            thread.start()
+
+    def _listen(self):
+        reconnect = False
+        while True:
+            try:
+                pubsub = self._client().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                if reconnect:
+                    # 重新订阅期间可能丢失消息
+                    self.local_cache.clear()
+                reconnect = True
+                for message in pubsub.listen():
+                    self._handle(message["data"])
+            except Exception:
+                logger.exception("local cache invalidation listener error")
+                time.sleep(1)
+
+    def _handle(self, data):
+        keys = json.loads(data)
+        if keys == "*":
+            self.local_cache.clear()
+        else:
+            self.local_cache.delete(*keys)
+
+    def publish(self, keys):
+        """
+        Args:
+            keys: 需要失效的key列表, "*" 表示清空
+        """
+        if keys == "*":
+            self.local_cache.clear()
+        else:
+            self.local_cache.delete(*keys)
+        if not self.enabled:
+            return
+        try:
+            self._client().publish(self.channel, json.dumps(keys))
+        except Exception:
+            logger.exception("local cache invalidation publish error")
+
+
+def _build():
+    config = dict(DEFAULT_LOCAL_CACHE, **getattr(settings, "LOCAL_CACHE", {}))
+    local = LocalCache(config["MAX_SIZE"], config["TTL"])
+    return local, InvalidationBus(local, config["CHANNEL"])
+
+
+local_cache, invalidation_bus = _build()
@@ -0,0 +1,110 @@
+# author:hao.lu
+# create_date: 10/20/2020 3:30 PM
+# file : message_catalog.py
+# IDE: PyCharm
+
+# ! -*- coding: utf-8 -*-
+from functools import lru_cache
+
+from utils import constant
+
+# Accept-Language的主语言 -> 信息中的语言key
+LANGUAGES = {"en": "US", "zh": "CN", "ja": "JP"}
+LANGUAGE_KEYS = frozenset(LANGUAGES.values())
+
+
+def _compile(module):
+    """
+    导入时将constant中的JSON_*多语言信息编译为索引
+    Returns: ({code: {语言: 信息}}, {信息: code}), code为去掉JSON_前缀的常量名
+
+    """
+    catalog = {}
+    index = {}
+    for name, value in vars(module).items():
+        if not (name.startswith("JSON_") and isinstance(value, dict) and value):
+            continue
+        if not set(value) <= LANGUAGE_KEYS:
+            continue
+        code = name[len("JSON_"):]
+        catalog[code] = dict(value)
+        for text in value.values():
+            index.setdefault(text, code)
+    return catalog, index
+
+
+CATALOG, TEXT_INDEX = _compile(constant)
+
+
+@lru_cache(maxsize=256)
+def get_language(accept_language):
+    """
+    按Accept-Language的权重选择支持的语言
+    Args:
+        accept_language: 请求头, example: "zh-CN,zh;q=0.9,en;q=0.8"
+
+    Returns: "US"、"CN"、"JP", 未指定或都不支持时返回None
+
+    """
+    if not accept_language:
+        return None
+    candidates = []
+    for position, item in enumerate(accept_language.split(",")):
+        tag, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        language = LANGUAGES.get(tag.split("-")[0].strip().lower())
+        if language and quality > 0:
+            candidates.append((-quality, position, language))
+    return min(candidates)[2] if candidates else None
+
+
+def translate(text, language):
+    """
+    目录中的信息转为指定语言, 其余原样返回
+    """
+    code = TEXT_INDEX.get(text) if isinstance(text, str) else None
+    if code is None:
+        return text
+    return CATALOG[code].get(language, text)
+
+
+def _fan_out(text, language):
+    if language is None:
+        return {"JP": text, "CN": text, "US": text}
+    return {language: translate(text, language)}
+
+
+def format_messages(msg, language=None):
+    """
+    异常信息转为返回结构中的msg列表
+    Args:
+        msg: 异常信息, 字段错误的字典或单条信息
+        language: 请求的语言, 为None时每条信息包含全部语言, 否则只包含请求的语言
+
+    Returns: 信息列表
+
+    """
+    if not isinstance(msg, dict):
+        return [translate(msg, language)]
+    messages = []
+    variants = {}
+    for key, value in msg.items():
+        if isinstance(value, list):
+            # 字段的多条错误取最后一条
+            messages.append(_fan_out(value[-1], language) if value else {})
+        elif key in LANGUAGE_KEYS:
+            if language is None or key == language:
+                variants[key] = value
+        elif language is not None and isinstance(value, dict) and language in value:
+            messages.append({language: value[language]})
+        else:
+            messages.append(value)
+    if variants:
+        messages.append(variants)
+    return messages
@@ -1,7 +1,25 @@
-from django.core.paginator import InvalidPage
+import hashlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import EmptyPage, InvalidPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
 from rest_framework import status
 from rest_framework.exceptions import APIException
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+
+DEFAULT_PAGINATION_COUNT = {
+    # 总数小于该值时每次精确COUNT
+    "EXACT_THRESHOLD": 10000,
+    # 大表总数的缓存时间(秒)
+    "TIMEOUT": 60,
+}
+COUNT_KEY = "count:{}:{}"
 
 
 class NotFoundException(APIException):
@@ -10,9 +28,113 @@ class NotFoundException(APIException):
     default_code = "bad_request"
 
 
+def estimate_count(queryset):
+    """
+    PostgreSQL中读取pg_class.reltuples作为无过滤条件查询的估算总数
+    Returns: 估算总数, 无法估算时返回None
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+            [connection.ops.quote_name(queryset.model._meta.db_table)],
+        )
+        row = cursor.fetchone()
+    # 从未ANALYZE的表reltuples为-1或0
+    return row[0] if row and row[0] > 0 else None
+
+
+def count_queryset(queryset):
+    """
+    统计查询结果总数
+    小表精确COUNT; 大表无过滤条件时使用reltuples估算, 否则按查询语句缓存COUNT结果
+    Args:
+        queryset: 查询集
+
+    Returns: (总数, 是否精确)
+
+    """
+    config = dict(DEFAULT_PAGINATION_COUNT, **getattr(settings, "PAGINATION_COUNT", {}))
+    threshold = config["EXACT_THRESHOLD"]
+    if not queryset.query.where:
+        estimate = estimate_count(queryset)
+        if estimate is not None and estimate >= threshold:
+            return estimate, False
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0, True
+    digest = hashlib.md5((sql + repr(params)).encode()).hexdigest()
+    key = COUNT_KEY.format(queryset.model._meta.db_table, digest)
+    count = cache.get(key)
+    if count is not None:
+        return count, False
+    count = queryset.count()
+    if count >= threshold:
+        cache.set(key, count, config["TIMEOUT"])
+    return count, True
+
+
+class EstimatedPage(Page):
+    """
+    总数不精确时的页, 是否有下一页按多取的一条数据判断
+    """
+
+    def __init__(self, object_list, number, paginator, has_more):
+        super().__init__(object_list, number, paginator)
+        self.has_more = has_more
+
+    def has_next(self):
+        return self.has_more
+
+
+class CountingPaginator(Paginator):
+    """
+    总数按count_queryset的策略计算, count_exact标记总数是否精确
+    总数为估算或缓存值时不以总数限制页码, 只有该页确实没有数据时才是空页
+    """
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, "query"):
+            self.count_exact = True
+            return super().count
+        count, self.count_exact = count_queryset(self.object_list)
+        return count
+
+    def validate_number(self, number):
+        self.count  # 计算总数时设置count_exact
+        if self.count_exact:
+            return super().validate_number(number)
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_("That page number is not an integer"))
+        if number < 1:
+            raise EmptyPage(_("That page number is less than 1"))
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if self.count_exact:
+            return super().page(number)
+        bottom = (number - 1) * self.per_page
+        # 多取一条判断是否还有下一页
+        object_list = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not object_list and number > 1:
+            raise EmptyPage(_("That page contains no results"))
+        has_more = len(object_list) > self.per_page
+        return EstimatedPage(object_list[:self.per_page], number, self, has_more)
+
+
 class MyPagination(PageNumberPagination):
     page_size = 3
     page_size_query_param = "page_size"
+    django_paginator_class = CountingPaginator
 
     def __init__(self):
         super().__init__()
@@ -43,3 +165,72 @@ class MyPagination(PageNumberPagination):
 
         self.request = request
         return list(self.page)
+
+    def get_paginated_response(self, data):
+        paginator = self.page.paginator
+        return Response(
+            OrderedDict(
+                [
+                    ("count", paginator.count),
+                    ("count_exact", paginator.count_exact),
+                    ("next", self.get_next_link()),
+                    ("previous", self.get_previous_link()),
+                    ("results", data),
+                ]
+            )
+        )
+
+
+class MyCursorPagination(CursorPagination):
+    """
+    键集分页, 按ordering的字段定位下一页, 不执行COUNT与OFFSET, 任意一页的开销与第一页相同
+    排序字段取视图的cursor_ordering, 默认按主键倒序
+    """
+
+    page_size = 3
+    page_size_query_param = "page_size"
+    ordering = "-pk"
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, "cursor_ordering", None) or self.ordering
+        if isinstance(ordering, str):
+            return (ordering,)
+        return tuple(ordering)
+
+
+class PaginationModeMixin:
+    """
+    分页方式可按视图的pagination_mode或查询参数pagination选择: page(默认)或cursor
+    page: 查询参数里没有page时不分页
+    cursor: 查询参数带cursor时也使用键集分页
+    """
+
+    pagination_mode = "page"
+    pagination_mode_query_param = "pagination"
+    cursor_ordering = "-pk"
+
+    def get_pagination_mode(self):
+        mode = self.request.query_params.get(self.pagination_mode_query_param)
+        if mode in ("page", "cursor"):
+            return mode
+        if self.request.query_params.get(MyCursorPagination.cursor_query_param):
+            return "cursor"
+        return self.pagination_mode
+
+    @property
+    def paginator(self):
+        if not hasattr(self, "_mode_paginator"):
+            if self.get_pagination_mode() == "cursor":
+                self._mode_paginator = MyCursorPagination()
+            else:
+                self._mode_paginator = super().paginator
+        return self._mode_paginator
+
+    def paginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        elif self.get_pagination_mode() == "page" and not self.request.query_params.get(
+            self.paginator.page_query_param, None
+        ):
+            return None
+        return self.paginator.paginate_queryset(queryset, self.request, view=self)
@@ -1,4 +1,12 @@
 from django.apps import apps
+from django.db.models import CharField, Exists, ExpressionWrapper, F, OuterRef
+
+from utils.hierarchy import Hierarchy
+
+
+def _parent_field(cls):
+    # Menu, Dept 以pid整数列关联父节点, DictType, Dict 以parent外键关联
+    return "pid" if hasattr(cls, "pid") else "parent"
 
 
 def get_child_queryset_u(check_queryset, obj, has_parent=True):
@@ -9,14 +17,10 @@ def get_child_queryset_u(check_queryset, obj, has_parent=True):
     是否包含父默认True
     """
     cls = type(obj)
-    queryset = cls.objects.none()
-    father_queryset = cls.objects.filter(pk=obj.id, is_deleted=False)
+    child_ids = Hierarchy(cls, _parent_field(cls)).descendant_ids([obj.pk])
+    queryset = check_queryset.filter(pk__in=child_ids, is_deleted=False)
     if has_parent:
-        queryset = queryset | father_queryset
-    child_queryset = check_queryset.filter(pid=obj, is_deleted=False)
-    while child_queryset:
-        queryset = queryset | child_queryset
-        child_queryset = check_queryset.filter(pid__in=child_queryset, is_deleted=False)
+        queryset = queryset | cls.objects.filter(pk=obj.pk, is_deleted=False)
     return queryset
 
 
@@ -29,36 +33,32 @@ def get_child_queryset(name, pk, has_parent=True):
     """
     app, model = name.split(".")
     cls = apps.get_model(app, model)
-    queryset = cls.objects.none()
-    father_queryset = cls.objects.filter(pk=pk, is_deleted=False)
-    if father_queryset.exists():
-        if has_parent:
-            queryset = queryset | father_queryset
-        child_queryset = cls.objects.filter(
-            pid=father_queryset.first(), is_deleted=False
-        )
-        while child_queryset:
-            queryset = queryset | child_queryset
-            child_queryset = cls.objects.filter(
-                pid__in=child_queryset, is_deleted=False
-            )
-    return queryset
+    if not cls.objects.filter(pk=pk, is_deleted=False).exists():
+        return cls.objects.none()
+    return Hierarchy(cls, _parent_field(cls)).descendants(pk, include_root=has_parent)
 
 
 def get_child_queryset2(obj, has_parent=True):
     """
     获取所有子集
     obj实例
-    数据表需包含parent字段
+    数据表需包含物化路径path字段
     是否包含父默认True
     """
     cls = type(obj)
-    queryset = cls.objects.none()
-    father_query_set = cls.objects.filter(pk=obj.dept_id, is_deleted=False)
-    if has_parent:
-        queryset = queryset | father_query_set
-    child_queryset = cls.objects.filter(pid=obj.dept_id, is_deleted=False)
-    while child_queryset:
-        queryset = queryset | child_queryset
-        child_queryset = cls.objects.filter(pid__in=child_queryset, is_deleted=False)
+    if not obj.path:
+        # 未生成路径的数据(如初始化sql导入的部门)按上级关系查询, 避免空前缀匹配全部数据
+        return get_child_queryset_u(cls.objects.all(), obj, has_parent)
+    # 已删除部门下的子部门不属于该子集, 以一个NOT EXISTS子查询排除
+    deleted_ancestors = (
+        cls.objects.filter(path__startswith=obj.path, is_deleted=True)
+        .exclude(pk=obj.pk)
+        .annotate(child_path=ExpressionWrapper(OuterRef("path"), CharField()))
+        .filter(child_path__startswith=F("path"))
+    )
+    queryset = cls.objects.filter(path__startswith=obj.path, is_deleted=False).filter(
+        ~Exists(deleted_ancestors)
+    )
+    if not has_parent:
+        queryset = queryset.exclude(pk=obj.pk)
     return queryset
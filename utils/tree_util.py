@@ -0,0 +1,35 @@
+# author:hao.lu
+# create_date: 10/15/2020 9:20 AM
+# file : tree_util.py
+# IDE: PyCharm
+
+# ! -*- coding: utf-8 -*-
+from collections import defaultdict
+
+
+def build_tree(nodes, id_key, pid_key="pid", all_roots=False, sort_key=None):
+    """
+    线性时间构建树型结构, 一次遍历按pid建立索引, 再一次遍历挂载子节点
+    Args:
+        nodes: 节点dict集合, 子节点顺序与nodes中的顺序一致
+        id_key: 节点ID的key, example: menu_id
+        pid_key: 父节点ID的key
+        all_roots: True时每个节点都作为根节点返回(查询结果构建), 否则只返回pid为None的节点
+        sort_key: 子节点排序函数, 为None时保持nodes中的顺序
+
+    Returns: 根节点集合, 子节点挂在"children"下
+
+    """
+    children = defaultdict(list)
+    for node in nodes:
+        children[node[pid_key]].append(node)
+    if sort_key is not None:
+        for child_list in children.values():
+            child_list.sort(key=sort_key)
+    for node in nodes:
+        child_list = children.get(node[id_key])
+        if child_list:
+            node["children"] = child_list
+    if all_roots:
+        return list(nodes)
+    return children.get(None, [])
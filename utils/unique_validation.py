@@ -0,0 +1,155 @@
+# author:hao.lu
+# create_date: 10/19/2020 5:10 PM
+# file : unique_validation.py
+# IDE: PyCharm
+
+# ! -*- coding: utf-8 -*-
+from collections.abc import Mapping
+
+from django.db import IntegrityError, transaction
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast
+from rest_framework import serializers
+
+
+def find_conflicts(model, items, fields):
+    """
+    一次查询找出与已有数据或同批数据重复的唯一字段
+    每个字段一个IN子查询, 以UNION合并为一条sql
+    Args:
+        model: 模型
+        items: [(主键, {字段: 值})], 新增时主键为None, 修改时排除自身
+        fields: 唯一字段
+
+    Returns: {(items下标, 字段)}
+
+    """
+    conflicts = set()
+    queries = []
+    for field in fields:
+        seen = {}
+        for index, (_, values) in enumerate(items):
+            value = values.get(field)
+            if value is None or value == "":
+                continue
+            value = str(value)
+            if value in seen:
+                conflicts.add((index, field))
+            else:
+                seen[value] = index
+        if seen:
+            queries.append(
+                model._default_manager.filter(**{"{}__in".format(field): list(seen)})
+                .order_by()
+                .annotate(
+                    unique_field=Value(field, output_field=CharField()),
+                    unique_value=Cast(field, CharField()),
+                    unique_pk=Cast("pk", CharField()),
+                )
+                .values_list("unique_field", "unique_value", "unique_pk")
+            )
+    if not queries:
+        return conflicts
+    rows = queries[0].union(*queries[1:]) if len(queries) > 1 else queries[0]
+    for field, value, pk in rows:
+        for index, (item_pk, values) in enumerate(items):
+            if str(values.get(field)) == value and str(item_pk) != pk:
+                conflicts.add((index, field))
+    return conflicts
+
+
+def _save_or_translate(save, model, items, fields, to_errors):
+    """
+    写入时违反数据库唯一约束(校验与写入之间的并发写入)转换为校验错误
+    """
+    try:
+        with transaction.atomic():
+            return save()
+    except IntegrityError:
+        conflicts = find_conflicts(model, items, fields)
+        if not conflicts:
+            raise
+        raise serializers.ValidationError(to_errors(conflicts))
+
+
+class UniqueFieldsMixin:
+    """
+    ModelSerializer的唯一性校验, 子类以 unique_fields = {字段: 重复时的提示} 声明
+    所有唯一字段在validate中一次查询, many=True时由UniqueListSerializer对整批一次查询,
+    Meta中需指定 list_serializer_class = UniqueListSerializer
+    """
+
+    unique_fields = {}
+
+    def _unique_pk(self):
+        if self.instance is not None:
+            return self.instance.pk
+        initial_data = getattr(self, "initial_data", None)
+        if isinstance(initial_data, Mapping):
+            return initial_data.get(self.Meta.model._meta.pk.name)
+        return None
+
+    def _unique_errors(self, conflicts):
+        return {field: self.unique_fields[field] for _, field in sorted(conflicts)}
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        if isinstance(self.parent, serializers.ListSerializer):
+            # 批量时由父级统一校验
+            return attrs
+        conflicts = find_conflicts(
+            self.Meta.model, [(self._unique_pk(), attrs)], self.unique_fields
+        )
+        if conflicts:
+            raise serializers.ValidationError(self._unique_errors(conflicts))
+        return attrs
+
+    def save(self, **kwargs):
+        items = [(self._unique_pk(), dict(self.validated_data, **kwargs))]
+        return _save_or_translate(
+            lambda: super(UniqueFieldsMixin, self).save(**kwargs),
+            self.Meta.model,
+            items,
+            self.unique_fields,
+            self._unique_errors,
+        )
+
+
+class UniqueListSerializer(serializers.ListSerializer):
+    """
+    many=True时对整批数据的唯一字段一次查询, 错误按下标返回
+    """
+
+    def _unique_items(self, data, values):
+        pk_name = self.child.Meta.model._meta.pk.name
+        return [
+            (item.get(pk_name) if isinstance(item, Mapping) else None, attrs)
+            for item, attrs in zip(data, values)
+        ]
+
+    def _unique_errors(self, conflicts, size):
+        errors = [{} for _ in range(size)]
+        for index, field in sorted(conflicts):
+            errors[index][field] = self.child.unique_fields[field]
+        return errors
+
+    def to_internal_value(self, data):
+        values = super().to_internal_value(data)
+        conflicts = find_conflicts(
+            self.child.Meta.model,
+            self._unique_items(data, values),
+            self.child.unique_fields,
+        )
+        if conflicts:
+            raise serializers.ValidationError(self._unique_errors(conflicts, len(values)))
+        return values
+
+    def save(self, **kwargs):
+        values = [dict(attrs, **kwargs) for attrs in self.validated_data]
+        return _save_or_translate(
+            lambda: super(UniqueListSerializer, self).save(**kwargs),
+            self.child.Meta.model,
+            self._unique_items(self.initial_data, values),
+            self.child.unique_fields,
+            lambda conflicts: self._unique_errors(conflicts, len(values)),
+        )